@@ -1,13 +1,26 @@
+import os
 import warnings
+from functools import partial
 
 from src.graphs import *
+from src.mean_field import mean_field_phase_diagram
+from src.parallel import run_sweep, read_sweep, split_sweep
 from src.plot import plot_all_graphs, plot_critical_t, plot_comparison_j_q, plot_critical_j, \
     plot_percolation_critical_j, plot_q_value
-from src.save_csv import save_results, load_results, load_results_mul
+from src.store import save_store, load_store, find_stores, import_csv, run_metadata
 from src.tests import *
 from src.config import *
 
 
+def sweep_metadata(test: str, graph_type: str, **values) -> dict:
+    # Parameters of the run saved with its results, the stores can be found by them with find_stores
+    metadata = {"test": test.rstrip("/"), "graph_type": graph_type, "n_nodes": n_nodes, "k": k,
+                "iterations": iterations, "max_j": max_j, "graph_seed": graph_seed, "replicas": replicas,
+                "vary_graphs": vary_graphs}
+    metadata.update(values)
+    return metadata
+
+
 def view_graphs():
     # RANDOM GRAPH WITH K
     PG, VG = random_graph_test(n_nodes, pPG=prob_k, pVG=prob_k)
@@ -36,78 +49,66 @@ def mean_field_test():
     test = "MF/"
     results = {}
 
-    # RANDOM GRAPH WITH K = 6
-    kk = 6
-    graph_type = "<k>=" + str(kk)
-    result = mean_field_jc_test(kk, perc_init_infect, iterations, ts, js)
-    path_test = "k"+str(kk)+"-int"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_j({graph_type: result}, file=test+path_test+".png")
-
-    # RANDOM GRAPH WITH K = 4
-    kk = 4
-    graph_type = "<k>=" + str(kk)
-    result = mean_field_jc_test(kk, perc_init_infect, iterations, ts, js)
-    path_test = "k"+str(kk)+"-int"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_j({graph_type: result}, file=test+path_test+".png")
-
-    # RANDOM GRAPH WITH K = 2
-    kk = 2
-    graph_type = "<k>=" + str(kk)
-    result = mean_field_jc_test(kk, perc_init_infect, iterations, ts, js)
-    path_test = "k"+str(kk)+"-int"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_j({graph_type: result}, file=test+path_test+".png")
+    # RANDOM GRAPHS WITH K = 6, 4, 2
+    kks = [6, 4, 2]
+
+    # Solve the fixed point of the mean field for all the degrees, tau and J at once
+    diagrams = mean_field_phase_diagram(kks, perc_init_infect, ts, js)
+
+    for kk in kks:
+        graph_type = "<k>=" + str(kk)
+        result = diagrams[kk]
+        # The fixed point does not depend on the number of iterations, it is not in the names and in the metadata
+        path_test = "k"+str(kk)+"-fixed"
+        metadata = sweep_metadata(test, graph_type, k=kk)
+        del metadata["iterations"]
+        save_store(result, path_stores+test+path_test, metadata)
+        results[graph_type] = result
+        plot_critical_j({graph_type: result}, file=test+path_test+".png")
 
     # PLOT ALL RESULTS
-    plot_critical_j(results, file=test+mean_field_jc_plot+"-"+str(iterations)+".png")
+    plot_critical_j(results, file=test+mean_field_jc_plot+"-fixed.png")
 
 
 def simple_percolation_test():
     test = "SIM/"
     results = {}
+    families = []
 
     # RANDOM GRAPH WITH K
-    PG, VG = random_graph_test(n_nodes, pPG=prob_k, pVG=prob_k)
-    graph_type = "Poisson <k>=" + str(k)
-    result = simple_tau_percolation_test(PG, iterations, ts)
+    PG, VG, infected_nodes = random_graph_csr_test(n_nodes, pPG=prob_k, pVG=prob_k, seed=graph_seed)
     path_test = "Poisson-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_t({graph_type: result}, file=test+path_test+".png")
+    families.append(("Poisson <k>=" + str(k), path_test, PG, infected_nodes, ("gnp", prob_k)))
 
     # RANDOM GRAPH WITH K*2
     kk = 2 * k
     prob_kk = kk / n_nodes
-    PG, VG = random_graph_test(n_nodes, pPG=prob_kk, pVG=prob_kk)
-    graph_type = "Poisson <k>=" + str(kk)
-    result = simple_tau_percolation_test(PG, iterations, ts)
+    PG, VG, infected_nodes = random_graph_csr_test(n_nodes, pPG=prob_kk, pVG=prob_kk, seed=graph_seed)
     path_test = "Poisson-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_t({graph_type: result}, file=test+path_test+".png")
+    families.append(("Poisson <k>=" + str(kk), path_test, PG, infected_nodes, ("gnp", prob_kk)))
 
     # CYCLE GRAPH
-    PG, VG = cycle_graph_test(n_nodes)
-    graph_type = "Cycle"
-    result = simple_tau_percolation_test(PG, iterations, ts)
+    PG, VG, infected_nodes = cycle_graph_csr_test(n_nodes, seed=graph_seed)
     path_test = "Cycle-nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_t({graph_type: result}, file=test+path_test+".png")
+    families.append(("Cycle", path_test, PG, infected_nodes, ("cycle", None)))
 
     # SCALE FREE GRAPH WITH K
-    PG, VG = scale_free_graph_test(n_nodes, mPG=k, mVG=k)
-    graph_type = "Scale Free <k>=" + str(k)
-    result = simple_tau_percolation_test(PG, iterations, ts)
+    PG, VG, infected_nodes = scale_free_graph_csr_test(n_nodes, mPG=k, mVG=k, seed=graph_seed)
     path_test = "ScaleFree-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_critical_t({graph_type: result}, file=test+path_test+".png")
+    families.append(("Scale Free <k>=" + str(k), path_test, PG, infected_nodes, ("ba", k)))
+
+    # Run the tests of all the graphs on the same process pool
+    graphs = {graph_type: PG for graph_type, _, PG, _, _ in families}
+    jobs = [simple_tau_percolation_jobs(graph_type, infected_nodes, iterations, ts, replicas,
+                                        partial(generate_graph, family, n_nodes, param) if vary_graphs else None)
+            for graph_type, _, _, infected_nodes, (family, param) in families]
+    sweep = split_sweep(run_sweep(sum(jobs, []), graphs), jobs)
+
+    for (graph_type, path_test, _, _, _), values in zip(families, sweep):
+        result = simple_tau_percolation_results(ts, values)
+        save_store(result, path_stores+test+path_test, sweep_metadata(test, graph_type))
+        results[graph_type] = result
+        plot_critical_t({graph_type: result}, file=test+path_test+".png")
 
     # PLOT ALL RESULTS
     plot_critical_t(results, file=test + simple_tc_plot+"-nodes"+str(n_nodes)+"_it"+str(iterations)+".png")
@@ -116,107 +117,132 @@ def simple_percolation_test():
 def percolation_test():
     test = "PERC/"
     results = {}
+    families = []
 
     # RANDOM GRAPH WITH K
-    PG, VG = random_graph_test(n_nodes, pPG=prob_k, pVG=prob_k)
-    graph_type = "Poisson <k>=" + str(k)
-    result = risk_percolation_j_test(PG, iterations, ts)
+    PG, VG, _ = random_graph_csr_test(n_nodes, pPG=prob_k, pVG=prob_k, seed=graph_seed)
     path_test = "Poisson-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_percolation_critical_j({graph_type: result}, file=test+path_test+".png")
+    families.append(("Poisson <k>=" + str(k), path_test, PG, ("gnp", prob_k)))
 
     # CYCLE GRAPH
-    PG, VG = cycle_graph_test(n_nodes)
-    graph_type = "Cycle"
-    result = risk_percolation_j_test(PG, iterations, ts)
+    PG, VG, _ = cycle_graph_csr_test(n_nodes, seed=graph_seed)
     path_test = "Cycle-nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_percolation_critical_j({graph_type: result}, file=test+path_test+".png")
+    families.append(("Cycle", path_test, PG, ("cycle", None)))
 
     # SCALE FREE GRAPH WITH K
-    PG, VG = scale_free_graph_test(n_nodes, mPG=k, mVG=k)
-    graph_type = "Scale Free <k>=" + str(k)
-    result = risk_percolation_j_test(PG, iterations, ts)
+    PG, VG, _ = scale_free_graph_csr_test(n_nodes, mPG=k, mVG=k, seed=graph_seed)
     path_test = "ScaleFree-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)
-    save_results(result, file=test+path_test+".csv")
-    results[graph_type] = result
-    plot_percolation_critical_j({graph_type: result}, file=test+path_test+".png")
+    families.append(("Scale Free <k>=" + str(k), path_test, PG, ("ba", k)))
+
+    # Run the tests of all the graphs on the same process pool
+    graphs = {graph_type: PG for graph_type, _, PG, _ in families}
+    jobs = [risk_percolation_j_jobs(graph_type, iterations, ts, replicas,
+                                    partial(generate_graph, family, n_nodes, param) if vary_graphs else None)
+            for graph_type, _, _, (family, param) in families]
+    sweep = split_sweep(run_sweep(sum(jobs, []), graphs), jobs)
+
+    for (graph_type, path_test, _, _), rows in zip(families, sweep):
+        result = risk_percolation_j_results(rows)
+        save_store(result, path_stores+test+path_test, sweep_metadata(test, graph_type))
+        results[graph_type] = result
+        plot_percolation_critical_j({graph_type: result}, file=test+path_test+".png")
 
     # PLOT ALL RESULTS
     plot_percolation_critical_j(results, file=test + percolation_jc_plot + "-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)+".png")
 
 
-def multiplex_percolation_test():
+def multiplex_percolation_test(resume: bool = True):
+    # Each (graph, q, tau) result is appended to the journal as it completes and an interrupted sweep continues
+    # from it. With resume False the results already in the journal are saved and plotted without running the rest
     test = "MUL/"
+    families = []
 
-    PG, VG = random_graph_test(n_nodes, pPG=prob_k, pVG=prob_k)
+    PG, VG, _ = random_graph_csr_test(n_nodes, pPG=prob_k, pVG=prob_k, seed=graph_seed)
     # graph_type = "Poisson <k>=" + str(k)
-    results = multiplex_percolation_jc_test(PG, VG, iterations, ts, qs)
     path_test = "Poisson-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)+"_jm"+str(max_j)
-    save_results(results, file=test+path_test+".csv")
-    plot_q_value(results, file=test+path_test+".png")
-    # TODO Visualize the comparison between j and q in the multiplex percolation test
-    # plot_comparison_j_q(results, "comparisonjq"+path_test+".png")
+    families.append((path_test, PG, VG, (("gnp", prob_k), ("gnp", prob_k))))
 
-    PG, VG = cycle_graph_test(n_nodes)
+    PG, VG, _ = cycle_graph_csr_test(n_nodes, seed=graph_seed)
     # graph_type = "Cycle"
-    results = multiplex_percolation_jc_test(PG, VG, iterations, ts, qs)
     path_test = "Cycle-nodes"+str(n_nodes)+"_it"+str(iterations)+"_jm"+str(max_j)
-    save_results(results, file=test+path_test+".csv")
-    plot_q_value(results, file=test+path_test+".png")
-    # TODO Visualize the comparison between j and q in the multiplex percolation test
-    # plot_comparison_j_q(results, "comparisonjq"+path_test+".png")
+    families.append((path_test, PG, VG, (("cycle", None), ("cycle", None))))
 
-    PG, VG = scale_free_graph_test(n_nodes, mPG=k, mVG=k)
+    PG, VG, _ = scale_free_graph_csr_test(n_nodes, mPG=k, mVG=k, seed=graph_seed)
     # graph_type = "Scale Free <k>=" + str(k)
-    results = multiplex_percolation_jc_test(PG, VG, iterations, ts, qs)
     path_test = "ScaleFree-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)+"_jm"+str(max_j)
-    save_results(results, file=test+path_test+".csv")
-    plot_q_value(results, file=test+path_test+".png")
-    # TODO Visualize the comparison between j and q in the multiplex percolation test
-    # plot_comparison_j_q(results, "comparisonjq"+path_test+".png")
+    families.append((path_test, PG, VG, (("ba", k), ("ba", k))))
 
-    PG, _ = random_graph_test(n_nodes, pPG=prob_k, pVG=prob_k)
-    _, VG = scale_free_graph_test(n_nodes, mPG=k, mVG=k)
+    PG = cached_graph("gnp", n_nodes, prob_k, (graph_seed, 0))
+    VG = cached_graph("ba", n_nodes, k, (graph_seed, 1))
     # graph_type = "Poisson <k>=" + str(k) + " and Scale Free <k>=" + str(k)
-    results = multiplex_percolation_jc_test(PG, VG, iterations, ts, qs)
     path_test = "Poisson-k"+str(k)+"+ScaleFree-k"+str(k)+"_nodes"+str(n_nodes)+"_it"+str(iterations)+"_jm"+str(max_j)
-    save_results(results, file=test+path_test+".csv")
-    plot_q_value(results, file=test+path_test+".png")
-    # TODO Visualize the comparison between j and q in the multiplex percolation test
-    # plot_comparison_j_q(results, "comparisonjq"+path_test+".png")
+    families.append((path_test, PG, VG, (("gnp", prob_k), ("ba", k))))
+
+    # Run the (graph, q, tau) jobs of all the graphs on the same process pool
+    graphs = {}
+    for path_test, PG, VG, _ in families:
+        graphs.update(multiplex_percolation_jc_graphs(path_test, PG, VG, qs))
+    jobs = [multiplex_percolation_jc_jobs(path_test, iterations, ts, qs, replicas,
+                                          tuple(partial(generate_graph, family, n_nodes, param)
+                                                for family, param in generators) if vary_graphs else None)
+            for path_test, _, _, generators in families]
+    path_journal = "nodes"+str(n_nodes)+"_it"+str(iterations)+"_jm"+str(max_j)+"_s"+str(graph_seed)
+    journal = path_journals + test + path_journal + ".jsonl"
+    if resume:
+        sweep = split_sweep(run_sweep(sum(jobs, []), graphs, journal=journal), jobs)
+    else:
+        sweep = split_sweep(read_sweep(sum(jobs, []), journal, graphs), jobs)
+
+    for (path_test, _, _, _), rows in zip(families, sweep):
+        results = multiplex_percolation_jc_results(rows)
+        save_store(results, path_stores+test+path_test, sweep_metadata(test, run_metadata(path_test)["graph_type"]))
+        plot_q_value(results, file=test+path_test+".png")
+        # TODO Visualize the comparison between j and q in the multiplex percolation test
+        # plot_comparison_j_q(results, "comparisonjq"+path_test+".png")
+
+
+def load_multiplex_store(path_test: str, **values) -> dict:
+    # Results of the multiplex run found by the metadata in its name and the other values, like graph_seed=0,
+    # the CSV of an older run is imported the first time. Runs that differ only in other values are not merged
+    test = "MUL/"
+    metadata = {**run_metadata(test+path_test), **values}
+    stores = find_stores(path_stores, **metadata)
+    if not stores and not os.path.isdir(path_stores+test+path_test):
+        import_csv(test+path_test+".csv", path_stores+test+path_test)
+        stores = find_stores(path_stores, **metadata)
+    if len(stores) != 1:
+        raise ValueError(f"{len(stores)} stores match {metadata}: {stores}")
+    return load_store(stores[0])
 
 
 def visualize_comparison():
     # Load results con jminf
     """
-    results = load_results_mul("MUL/Cycle-nodes10000_it100_jminf.csv")
+    results = load_multiplex_store("Cycle-nodes10000_it100_jminf")
     plot_comparison_j_q(results, "comparisonjq-Cycle-nodes10000_it100_jminf.png")
 
-    results = load_results_mul("MUL/Poisson-k3_nodes10000_it100_jminf.csv")
+    results = load_multiplex_store("Poisson-k3_nodes10000_it100_jminf")
     plot_comparison_j_q(results, "comparisonjq-Poisson-k3_nodes10000_it100_jminf.png")
 
-    results = load_results_mul("MUL/ScaleFree-k3_nodes10000_it100_jminf.csv")
+    results = load_multiplex_store("ScaleFree-k3_nodes10000_it100_jminf")
     plot_comparison_j_q(results, "comparisonjq-ScaleFree-k3_nodes10000_it100_jminf.png")
 
-    results = load_results_mul("MUL/Poisson-k6+ScaleFree-k6_nodes10000_it100_jminf.csv")
+    results = load_multiplex_store("Poisson-k6+ScaleFree-k6_nodes10000_it100_jminf")
     plot_comparison_j_q(results, "comparisonjq-Poisson-k6+ScaleFree-k6_nodes10000_it100_jminf.png")
     """
 
     # Load results con jm100
 
-    results = load_results_mul("MUL/Cycle-nodes10000_it100_jm100.csv")
+    results = load_multiplex_store("Cycle-nodes10000_it100_jm100")
     plot_comparison_j_q(results, "zcjq-Cycle-nodes10000_it100_jm100.png")
 
-    results = load_results_mul("MUL/Poisson-k6_nodes10000_it100_jm100.csv")
+    results = load_multiplex_store("Poisson-k6_nodes10000_it100_jm100")
     plot_comparison_j_q(results, "zcjq-Poisson-k3_nodes10000_it100_jm100.png")
 
-    results = load_results_mul("MUL/ScaleFree-k6_nodes10000_it100_jm100.csv")
+    results = load_multiplex_store("ScaleFree-k6_nodes10000_it100_jm100")
     plot_comparison_j_q(results, "zcjq-ScaleFree-k3_nodes10000_it100_jm100.png")
 
-    results = load_results_mul("MUL/Poisson-k6+ScaleFree-k6_nodes10000_it100_jm100.csv")
+    results = load_multiplex_store("Poisson-k6+ScaleFree-k6_nodes10000_it100_jm100")
     plot_comparison_j_q(results, "zcjq-Poisson-k6+ScaleFree-k6_nodes10000_it100_jm100.png")
 
 
@@ -0,0 +1,62 @@
+import os
+import shutil
+
+
+def touch(path: str) -> None:
+    """
+    Mark the entry of the cache as used now, the least recently used entries are evicted first
+    An entry removed meanwhile by another process is ignored.
+
+    :param path: file or directory of the entry
+    """
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def entry_size(path: str) -> int:
+    """
+    Get the size in bytes of an entry of the cache
+
+    :param path: file or directory of the entry
+    :return: size of the entry
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def evict_lru(directory: str, max_bytes: int) -> None:
+    """
+    Remove the least recently used entries of the cache directory until its size is at most max_bytes
+    The most recently used entry and the entries being written, whose name contains ".tmp-", are never removed.
+    Several processes can evict from the same cache, the entries they remove meanwhile are skipped.
+
+    :param directory: directory of the cache
+    :param max_bytes: maximum size of the cache
+    """
+    if not os.path.isdir(directory):
+        return
+    entries = []
+    for name in os.listdir(directory):
+        if ".tmp-" in name:
+            continue
+        entry = os.path.join(directory, name)
+        try:
+            entries.append((os.path.getmtime(entry), entry_size(entry), entry))
+        except FileNotFoundError:
+            continue
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in entries[:-1]:
+        if total <= max_bytes:
+            break
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+        total -= size
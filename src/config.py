@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 from src.utils import *
 
@@ -8,14 +10,39 @@ js = np.arange(0, max_j, step)  # Risk perception
 ts = np.arange(0, 1 + step, step)  # Tau values
 qs = np.arange(0, 1 + step, step)  # Connection probability for Information Graph
 
+# Values for the critical J search
+j_resolution = step  # Width of the final bracket around the critical J
+j_trials = 3  # Number of trials voting if the infection dies out near the critical J
+j_noise = 1.0  # Width of the bracket below which the trials are repeated
+
 iterations = 100  # Iteration
+batch_size = 512  # Number of (tau, J) replicas simulated at the same time
 zero_threshold = 1e-4  # Zero threshold
 eps = 1e-4  # Epsilon
+conv_window = 10  # Number of iterations the percentage of infected nodes must stay stationary to stop early
+conv_tol = 1e-3  # Relative tolerance of a stationary percentage of infected nodes
+stall_window = 20  # Number of iterations the maximum J or the minimum tau must stay the same to stop early
+
+backend = "numba"  # Backend of the percolation kernels, "numba" if it is installed or "numpy"
+
+# Values for the parallel sweeps
+n_workers = os.cpu_count()  # Number of worker processes, 1 to run the sweeps serially
+master_seed = 0  # Seed from which the seed of each job is derived
+
+# Values for the ensembles
+replicas = 1  # Number of replicas of each point of the sweeps, the results have error bars when > 1
+vary_graphs = False  # Generate a new graph for each replica instead of only running new dynamics on the same graph
+ensemble_quantiles = (0.05, 0.5, 0.95)  # Quantiles of the replicas estimated online
 
 # Values for the graph
 n_nodes = 10000  # Number of nodes
 k = 6  # Number of edges to attach from a new node
 prob_k = k / n_nodes  # Probability for random graph
+graph_seed = 0  # Seed of the generated graphs, None to generate new graphs at every run
+graph_cache_bytes = 2 ** 30  # Maximum size of the cache of the generated graphs
+stream_block = 2 ** 20  # Number of edges read at once when a graph is converted on disk
+memo_results = True  # Memoize the results of the percolation kernels on disk, by graph, parameters and random state
+memo_cache_bytes = 2 ** 28  # Maximum size of the cache of the memoized results
 
 # Values for the infection
 init_infect = 2  # Initial infected nodes
@@ -23,3 +50,5 @@ perc_init_infect = init_infect / n_nodes  # Initial percentage of infected nodes
 
 immunity = healthy  # Immunity
 rec_prob = 0.1  # Recovery probability
+table_max_degree = 256  # Largest degree in the lookup tables of p(s, k), larger degrees are computed directly
+table_cache_size = 64  # Number of (tau, J) lookup tables of p(s, k) kept in memory
@@ -0,0 +1,53 @@
+from collections import deque
+from typing import Optional
+
+from src.config import conv_window, conv_tol
+
+# Reasons for stopping early
+absorbing_state = "absorbing"
+stationary_state = "stationary"
+
+
+class ConvergenceMonitor:
+    """
+    Detect the convergence of an iterative routine from the value it observes after each iteration,
+    the percentage of infected nodes or the maximum J value.
+    The routine stops when the value reaches the absorbing state (no infected nodes, J = 0) or when it stays
+    within the relative tolerance over the last window iterations (stationary fraction, stalled maximum J).
+
+    After the routine stops, iteration is the number of iterations run and reason why it stopped, None if it
+    ran all the iterations.
+    """
+
+    def __init__(self, tol: float = conv_tol, window: int = conv_window, absorbing: Optional[float] = 0.0):
+        """
+        :param tol: relative tolerance of a stationary value, negative to never stop for stationarity
+        :param window: number of iterations the value must stay stationary
+        :param absorbing: value of the absorbing state, None if there is none
+        """
+        self.tol = tol
+        self.window = window
+        self.absorbing = absorbing
+        self.values = deque(maxlen=window)
+        self.iteration = 0
+        self.reason = None
+
+    def update(self, value: float) -> bool:
+        """
+        Observe the value after an iteration
+
+        :param value: value after the iteration
+        :return: return True if the routine should stop
+        """
+        self.iteration += 1
+        if self.absorbing is not None and value == self.absorbing:
+            self.reason = absorbing_state
+            return True
+
+        self.values.append(value)
+        if len(self.values) == self.window:
+            spread = max(self.values) - min(self.values)
+            if spread <= self.tol * max(abs(v) for v in self.values):
+                self.reason = stationary_state
+                return True
+        return False
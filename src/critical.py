@@ -0,0 +1,91 @@
+from functools import partial
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.config import zero_threshold, j_resolution, j_trials, j_noise
+
+
+def is_extinct(simulate: Callable[[float], float],
+               j: float,
+               trials: int = 1,
+               threshold: float = zero_threshold) -> bool:
+    """
+    Check if the infection dies out for the risk perception j
+    With more trials the answer is the majority vote, stopping as soon as the majority is reached.
+
+    :param simulate: function returning the percentage of infected nodes for a value of J
+    :param j: risk perception
+    :param trials: number of trials
+    :param threshold: zero threshold
+    :return: return True if the infection dies out
+    """
+    votes = 0
+    for i in range(trials):
+        votes += simulate(j) <= threshold
+        if votes > trials // 2 or votes + trials - i - 1 <= trials // 2:
+            break
+    return votes > trials // 2
+
+
+def linear_critical_j(simulate: Callable[[float], float],
+                      js: np.array,
+                      threshold: float = zero_threshold) -> Optional[tuple]:
+    """
+    Find the critical J scanning the values of js, the first one for which the infection dies out
+
+    :param simulate: function returning the percentage of infected nodes for a value of J
+    :param js: values of risk perception J, in increasing order
+    :param threshold: zero threshold
+    :return: return the critical J with its lower and upper bounds, None if the infection never dies out
+    """
+    for i, j in enumerate(js):
+        if simulate(j) <= threshold:
+            return j, js[max(i - 1, 0)], j
+    return None
+
+
+def bisect_critical_j(simulate: Callable[[float], float],
+                      js: np.array,
+                      resolution: float = j_resolution,
+                      trials: int = j_trials,
+                      noise: float = j_noise,
+                      threshold: float = zero_threshold) -> Optional[tuple]:
+    """
+    Find the critical J by bracketing and bisection
+    The search starts from the bracket [js[0], js[-1]], doubling the upper bound if the infection survives at it,
+    and halves the bracket until it is narrower than resolution.
+    Once the bracket is narrower than noise every point is decided by the majority of trials simulations.
+
+    :param simulate: function returning the percentage of infected nodes for a value of J
+    :param js: values of risk perception J, only the first and the last are used
+    :param resolution: width of the final bracket
+    :param trials: number of trials near the critical J
+    :param noise: width of the bracket below which the trials are repeated
+    :param threshold: zero threshold
+    :return: return the critical J with its lower and upper bounds, None if the infection never dies out
+    """
+    low, high = float(js[0]), float(js[-1])
+    if is_extinct(simulate, low, trials, threshold):
+        return low, low, low
+
+    # Bracketing
+    for _ in range(10):
+        if is_extinct(simulate, high, 1, threshold):
+            break
+        low, high = high, 2 * high
+    else:
+        return None
+
+    # Bisection
+    while high - low > resolution:
+        mid = (low + high) / 2
+        if is_extinct(simulate, mid, trials if high - low <= noise else 1, threshold):
+            high = mid
+        else:
+            low = mid
+    return high, low, high
+
+
+# Bisection of a deterministic map, like the mean field, where one simulation decides every point
+bisect_deterministic_j = partial(bisect_critical_j, trials=1)
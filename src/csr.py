@@ -0,0 +1,336 @@
+import os
+import shutil
+from typing import NamedTuple
+
+import networkx as nx
+import numpy as np
+import scipy
+
+from src.config import stream_block
+
+
+class CSRGraph(NamedTuple):
+    """
+    Compressed sparse row representation of a graph
+    The neighbors of node i are indices[indptr[i]:indptr[i + 1]] and degree[i] is their number.
+    For a directed graph the neighbors are the successors, as in G.neighbors(node).
+    """
+    indptr: np.ndarray
+    indices: np.ndarray
+    degree: np.ndarray
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+
+def csr_from_edges(n: int, src: np.ndarray, dst: np.ndarray, directed: bool = False) -> CSRGraph:
+    """
+    Build the CSR representation from an edge list
+
+    :param n: number of nodes
+    :param src: source node of each edge
+    :param dst: destination node of each edge
+    :param directed: if False every edge is stored in both directions
+    :return: CSR graph
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    if not directed:
+        # Self loops are stored only once, as in G.neighbors(node)
+        loop = src != dst
+        src, dst = np.concatenate((src, dst[loop])), np.concatenate((dst, src[loop]))
+
+    # Sorting the (src, dst) keys is faster than sorting the edges by two columns
+    indices = (np.sort(src * n + dst) % max(n, 1)).astype(np.int32)
+    degree = np.bincount(src, minlength=n).astype(np.int64)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(degree, out=indptr[1:])
+    return CSRGraph(indptr, indices, degree)
+
+
+def to_csr(G: nx.Graph, nodes: list = None) -> CSRGraph:
+    """
+    Convert a NetworkX graph to the CSR representation
+    Node i of the CSR graph is the i-th node of nodes (G.nodes() if not given)
+
+    :param G: graph
+    :param nodes: ordering of the nodes, use it to share the node index between graphs
+    :return: CSR graph
+    """
+    nodes = list(G.nodes()) if nodes is None else list(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    return csr_from_edges(len(nodes), edges[:, 0], edges[:, 1], directed=G.is_directed())
+
+
+def as_csr(G) -> CSRGraph:
+    """
+    Return G as a CSR graph, converting it only if it is a NetworkX graph
+
+    :param G: NetworkX or CSR graph
+    :return: CSR graph
+    """
+    return G if isinstance(G, CSRGraph) else to_csr(G)
+
+
+def save_csr(G: CSRGraph, path: str) -> None:
+    """
+    Save the CSR graph as one .npy file for each array in the directory path
+    The arrays are written in a temporary directory that is renamed at the end, so a directory is always complete.
+
+    :param G: CSR graph
+    :param path: directory of the graph
+    """
+    temporary = path.rstrip("/") + ".tmp-" + str(os.getpid())
+    os.makedirs(temporary, exist_ok=True)
+    for name, array in zip(G._fields, G):
+        np.save(os.path.join(temporary, name + ".npy"), array)
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        # Another process saved the same graph first
+        shutil.rmtree(temporary, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+
+
+def load_csr(path: str, mmap: bool = True) -> CSRGraph:
+    """
+    Load the CSR graph saved with save_csr
+
+    :param path: directory of the graph
+    :param mmap: if True the arrays are memory mapped read only instead of read in memory
+    :return: CSR graph
+    """
+    mode = "r" if mmap else None
+    return CSRGraph(*(np.load(os.path.join(path, name + ".npy"), mmap_mode=mode) for name in CSRGraph._fields))
+
+
+def to_networkx(G: CSRGraph, directed: bool = False) -> nx.Graph:
+    """
+    Convert a CSR graph to a NetworkX graph with the nodes 0, ..., n - 1
+
+    :param G: CSR graph
+    :param directed: if True return a DiGraph
+    :return: graph
+    """
+    graph = nx.DiGraph() if directed else nx.Graph()
+    graph.add_nodes_from(range(G.n_nodes))
+    graph.add_edges_from(zip(segment_rows(G).tolist(), G.indices.tolist()))
+    return graph
+
+
+def adjacency_matrix(G: CSRGraph, dtype: type = float) -> scipy.sparse.csr_matrix:
+    """
+    Get the sparse adjacency matrix of the CSR graph, sharing its index arrays
+    (A @ x)[i] is the sum of x over the neighbors of node i.
+
+    :param G: CSR graph
+    :param dtype: type of the entries, an integer type counts the neighbors without converting x to float
+    :return: sparse adjacency matrix
+    """
+    data = np.ones(len(G.indices), dtype=dtype)
+    return scipy.sparse.csr_matrix((data, G.indices, G.indptr), shape=(G.n_nodes, G.n_nodes))
+
+
+def segment_rows(G: CSRGraph) -> np.ndarray:
+    """
+    Get the node of each edge of the CSR graph, the i such that indptr[i] <= edge < indptr[i + 1]
+
+    :param G: CSR graph
+    :return: node of each edge
+    """
+    return np.repeat(np.arange(G.n_nodes), G.degree)
+
+
+def gather_neighbors(G: CSRGraph, nodes: np.ndarray) -> np.ndarray:
+    """
+    Get the neighbors of all the given nodes, concatenated in the order of the nodes
+
+    :param G: CSR graph
+    :param nodes: nodes whose neighbors are gathered
+    :return: neighbors of the nodes, repeated once for each node they are a neighbor of
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    counts = G.degree[nodes]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return G.indices[np.repeat(G.indptr[nodes], counts) + offsets]
+
+
+def segment_reduce(ufunc: np.ufunc, G: CSRGraph, values: np.ndarray, empty: float) -> np.ndarray:
+    """
+    Reduce the values of the edges of each node, as ufunc.reduce(values[indptr[i]:indptr[i + 1]])
+
+    :param ufunc: reduction, like np.minimum or np.maximum
+    :param G: CSR graph
+    :param values: value of each edge
+    :param empty: value of the nodes without neighbors
+    :return: reduced value of each node
+    """
+    result = np.full(G.n_nodes, empty, dtype=float)
+    # reduceat needs strictly increasing starts, so the nodes without neighbors are skipped
+    connected = G.degree > 0
+    if connected.any():
+        result[connected] = ufunc.reduceat(values, G.indptr[:-1][connected])
+    return result
+
+
+def count_greater_equal(G: CSRGraph,
+                        values: np.ndarray,
+                        rows: np.ndarray,
+                        queries: np.ndarray,
+                        ranks: np.ndarray = None) -> np.ndarray:
+    """
+    Count for each query the neighbors of its node whose value is greater than or equal to the value of the query
+    The result is the number of j in indices[indptr[rows[q]]:indptr[rows[q] + 1]] with values[j] >= values[queries[q]].
+    The neighbors are sorted once by (node, rank of the value) and every count is a binary search.
+
+    :param G: CSR graph
+    :param values: value of each node
+    :param rows: node of each query
+    :param queries: node whose value is compared, for each query
+    :param ranks: dense ranks of the values, computed if not given, pass them when G is a block of a larger graph
+    :return: count of each query
+    """
+    # Dense ranks of the node values, so that (node, rank) is a single integer key
+    if ranks is None:
+        _, ranks = np.unique(values, return_inverse=True)
+    base = len(values) + 1
+    keys = np.sort(segment_rows(G) * base + ranks[G.indices])
+    first = np.searchsorted(keys, rows * base + ranks[queries], side="left")
+    return G.indptr[rows + 1] - first
+
+
+# ______________________________________________________________________________________________________________________
+# Streaming graphs from disk
+
+
+def node_blocks(G: CSRGraph, block_size: int = None):
+    """
+    Split the CSR graph in blocks of consecutive nodes, reading the neighbors of one block at a time
+    The block is a CSR graph whose node i is node start + i of G, while its indices are still the nodes of G.
+    With a memory mapped graph only the neighbors of the current block are read in memory.
+
+    :param G: CSR graph
+    :param block_size: number of nodes of each block, the whole graph is a single block if None
+    :return: generator of (start, stop, block)
+    """
+    block_size = max(G.n_nodes, 1) if block_size is None else block_size
+    for start in range(0, G.n_nodes, block_size):
+        stop = min(start + block_size, G.n_nodes)
+        low, high = G.indptr[start], G.indptr[stop]
+        indptr = np.asarray(G.indptr[start:stop + 1]) - low
+        yield start, stop, CSRGraph(indptr, np.asarray(G.indices[low:high]), np.asarray(G.degree[start:stop]))
+
+
+def neighbor_sum(G: CSRGraph, x: np.ndarray, block_size: int = None) -> np.ndarray:
+    """
+    Sum x over the neighbors of each node, as adjacency_matrix(G) @ x, one block of nodes at a time
+
+    :param G: CSR graph
+    :param x: value of each node
+    :param block_size: number of nodes of each block
+    :return: sum of each node
+    """
+    result = np.empty(G.n_nodes)
+    for start, stop, block in node_blocks(G, block_size):
+        weights = np.asarray(x[block.indices], dtype=float)
+        result[start:stop] = np.bincount(segment_rows(block), weights=weights, minlength=stop - start)
+    return result
+
+
+def neighbor_count(G: CSRGraph, x: np.ndarray, block_size: int = None) -> np.ndarray:
+    """
+    Count the neighbors of each node where x is True, as neighbor_sum with integer counts, one block of nodes at a time
+
+    :param G: CSR graph
+    :param x: boolean value of each node
+    :param block_size: number of nodes of each block
+    :return: count of each node
+    """
+    result = np.empty(G.n_nodes, dtype=np.int64)
+    for start, stop, block in node_blocks(G, block_size):
+        result[start:stop] = np.bincount(segment_rows(block)[x[block.indices]], minlength=stop - start)
+    return result
+
+
+def edge_list_to_csr(edges_path: str,
+                     path: str,
+                     nodes: int = None,
+                     directed: bool = False,
+                     dtype: type = np.int32,
+                     block_size: int = stream_block) -> CSRGraph:
+    """
+    Convert a binary edge list to a CSR graph on disk, without reading the whole edge list in memory
+    The edge list is a raw file of (src, dst) pairs of the given dtype, read with np.memmap in blocks of edges.
+    The degrees are counted in a first pass and the neighbors are written in the memory mapped indices in a second,
+    in the order of the edge list. The graph is saved in the directory path like save_csr, replacing a graph
+    converted before, and returned memory mapped.
+
+    :param edges_path: file of the edge list
+    :param path: directory of the graph
+    :param nodes: number of nodes, the largest node in the edge list + 1 if None
+    :param directed: if False every edge is stored in both directions
+    :param dtype: integer type of the edge list
+    :param block_size: number of edges read at once
+    :return: CSR graph
+    """
+    edges = np.memmap(edges_path, dtype=dtype, mode="r").reshape(-1, 2)
+
+    def edge_blocks():
+        for start in range(0, len(edges), block_size):
+            src = edges[start:start + block_size, 0].astype(np.int64)
+            dst = edges[start:start + block_size, 1].astype(np.int64)
+            yield src, dst
+            if not directed:
+                # Self loops are stored only once, as in csr_from_edges
+                loop = src != dst
+                yield dst[loop], src[loop]
+
+    if nodes is None:
+        nodes = max((int(src.max()) + 1 for src, _ in edge_blocks() if len(src)), default=0)
+    degree = np.zeros(nodes, dtype=np.int64)
+    for src, _ in edge_blocks():
+        degree += np.bincount(src, minlength=nodes)
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(degree, out=indptr[1:])
+
+    temporary = path.rstrip("/") + ".tmp-" + str(os.getpid())
+    os.makedirs(temporary, exist_ok=True)
+    try:
+        np.save(os.path.join(temporary, "indptr.npy"), indptr)
+        np.save(os.path.join(temporary, "degree.npy"), degree)
+        indices = np.lib.format.open_memmap(os.path.join(temporary, "indices.npy"), mode="w+",
+                                            dtype=np.int32, shape=(int(indptr[-1]),))
+        # Next free position of the neighbors of each node
+        cursor = indptr[:-1].copy()
+        for src, dst in edge_blocks():
+            order = np.argsort(src, kind="stable")
+            src, dst = src[order], dst[order]
+            first = np.searchsorted(src, src, side="left")
+            indices[cursor[src] + np.arange(len(src)) - first] = dst
+            heads, counts = np.unique(src, return_counts=True)
+            cursor[heads] += counts
+        indices.flush()
+        del indices
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+    if os.path.isdir(path):
+        # A graph converted before is replaced, it is moved away first since os.replace needs an empty directory
+        stale = path.rstrip("/") + ".old-" + str(os.getpid())
+        try:
+            os.replace(path, stale)
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(stale, ignore_errors=True)
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        # Another process converted the graph first
+        shutil.rmtree(temporary, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    return load_csr(path)
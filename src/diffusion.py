@@ -2,9 +2,13 @@ import networkx as nx
 import numpy as np
 from matplotlib import pyplot as plt
 
-from src.infection import init_infected, update_risk, new_infected, change_state, get_infected
+from src.config import master_seed
+from src.csr import CSRGraph, to_csr, gather_neighbors
+from src.infection import init_infected_array, set_states_array, get_infected_array, prob_being_infected_lookup
 from src.plot import plot_critical_j, plot_update
-from src.utils import healthy, t_test, j_test, critical_j_plot
+from src.seeding import stream
+from src.states import NodeStates
+from src.utils import healthy, t_test, j_test, critical_j_plot, state_codes, healthy_code, infected_code
 
 
 def critical_j_test(G: nx.Graph,
@@ -12,9 +16,11 @@ def critical_j_test(G: nx.Graph,
                     js: np.array,
                     rec_prob: float = 0.2,
                     immunity: str = healthy,
-                    plot: bool = False):
+                    plot: bool = False,
+                    seed: int = master_seed):
     """
     Get the critical J values test
+    Each (tau, J) trial has its own random stream, so a trial gives the same result in any scan.
 
     :param G: graph
     :param ts: values of tau
@@ -22,13 +28,17 @@ def critical_j_test(G: nx.Graph,
     :param rec_prob: recovery probability
     :param immunity: if the nodes have immunity
     :param plot: if the graph should be displayed
+    :param seed: master seed
     :return: return the critical J values
     """
+    # The topology is converted once and shared by all the trials, each trial only creates its node states
+    csr = to_csr(G)
     results = {t_test: [], j_test: []}
     for t in ts:
         for j in js:
             print(f"t: {t}, j: {j}")
-            v = diffusion(G.copy(), j, t, rec_prob=rec_prob, immunity=immunity, plot=plot)
+            rng = stream((critical_j_test, t, j, rec_prob, immunity), seed)
+            v = diffusion(G, j, t, rec_prob=rec_prob, immunity=immunity, plot=plot, csr=csr, rng=rng)
             if v <= 0:
                 results[t_test].append(t)
                 results[j_test].append(j)
@@ -45,9 +55,15 @@ def diffusion(G: nx.Graph,
               infected_nodes: int = 1,
               immunity: str = healthy,
               plot: bool = False,
+              csr: CSRGraph = None,
+              frontier: bool = False,
+              continuous: bool = False,
+              rng: np.random.Generator = None,
               ) -> int:
     """
     Propagate the disease in the graph G
+    The states of the nodes are a uint8 array, G is only read and its states are set just to plot them.
+    Without plot the frontier mode runs frontier_diffusion, whose time scales with the size of the epidemic.
 
     :param G: graph
     :param J: perception risk
@@ -57,21 +73,97 @@ def diffusion(G: nx.Graph,
     :param infected_nodes: number of infected nodes, default 2
     :param immunity: recovered if immunity is possible
     :param plot: if the graph should be plotted
+    :param csr: CSR graph of G, converted if not given
+    :param frontier: only update the infected nodes and their neighbors, see frontier_diffusion
+    :param continuous: continuous time recovery in the frontier mode, see frontier_diffusion
+    :param rng: random generator of the initial infected nodes and of the steps
     :return: return the number of infected nodes
     """
-    init_infected(G, infected_nodes)
+    csr = to_csr(G) if csr is None else csr
+    rng = np.random.default_rng() if rng is None else rng
+    states = init_infected_array(csr.n_nodes, infected_nodes, rng)
+    if frontier and not plot:
+        return frontier_diffusion(csr, states, J, t, rec_prob, iteration, state_codes[immunity], rng, continuous)
+    node_states = NodeStates(csr, states)
+    states = node_states.states
 
-    pos = nx.spring_layout(G)
-    plt.figure()
+    if plot:
+        pos = nx.spring_layout(G)
+        plt.figure()
 
     for i in range(iteration):
         if plot:
+            set_states_array(G, states)
             plot_update(G, pos)
-        update_risk(G, J, t)
-        G = new_infected(G)
-        G = change_state(G, rec_prob, immunity)
-        print(f"Step: {i + 1}, Infected: {get_infected(G)}")
-        print(G.nodes.data())
-        print("\n")
-
-    return get_infected(G)
+        risk = node_states.risk(J, t)
+        # The counts of the infected neighbors are updated only around the nodes that change state
+        r = rng.random(len(states))
+        node_states.set_states(np.flatnonzero((r < risk) & (states == healthy_code)), infected_code)
+        r = rng.random(len(states))
+        node_states.set_states(np.flatnonzero((r < rec_prob) & (states == infected_code)), state_codes[immunity])
+        print(f"Step: {i + 1}, Infected: {get_infected_array(states)}")
+
+    return get_infected_array(states)
+
+
+def frontier_diffusion(G: CSRGraph,
+                       states: np.ndarray,
+                       J: float,
+                       t: float,
+                       rec_prob: float,
+                       iteration: int = 50,
+                       immunity: int = healthy_code,
+                       rng: np.random.Generator = None,
+                       continuous: bool = False) -> int:
+    """
+    Propagate the disease like diffusion, touching only the infected nodes and their healthy neighbors
+    The number of infected neighbors of every node is kept up to date by NodeStates, so a step costs the degrees
+    of the infected nodes instead of the whole graph. With immunity = recovered_code it is a SIR model,
+    with healthy_code a SIS model.
+
+    In the continuous mode each infected node draws its recovery time once when it is infected, exponential with
+    the rate -log(1 - rec_prob) that recovers it within a step with probability rec_prob, and recovers at the end
+    of the step containing that time, instead of drawing a random number for every infected node at every step.
+
+    :param G: CSR graph
+    :param states: initial states of the nodes, not modified
+    :param J: perception risk
+    :param t: bare infection probability
+    :param rec_prob: prob of recovering at each step
+    :param iteration: number of iterations
+    :param immunity: code of the state of the recovered nodes
+    :param rng: random generator
+    :param continuous: draw continuous recovery times instead of recovering at each step with probability rec_prob
+    :return: return the number of infected nodes
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    node_states = NodeStates(G, states)
+    states = node_states.states
+    active = np.flatnonzero(states == infected_code)
+
+    if continuous:
+        rate = -np.log1p(-rec_prob) if rec_prob < 1 else np.inf
+        scale = 1 / rate if rate > 0 else np.inf
+        recovery = np.full(G.n_nodes, np.inf)
+        recovery[active] = rng.exponential(scale, len(active))
+
+    for step in range(iteration):
+        if len(active) == 0:
+            break
+        # Only the healthy neighbors of the infected nodes can be infected, the others have s = 0
+        candidates = np.unique(gather_neighbors(G, active))
+        candidates = candidates[states[candidates] == healthy_code]
+        risk = prob_being_infected_lookup(node_states.s[candidates], G.degree[candidates], t, J)
+        new = candidates[rng.random(len(candidates)) < risk]
+        node_states.set_states(new, infected_code)
+        active = np.concatenate((active, new))
+
+        if continuous:
+            recovery[new] = step + rng.exponential(scale, len(new))
+            recovered = active[recovery[active] <= step + 1]
+        else:
+            recovered = active[rng.random(len(active)) < rec_prob]
+        node_states.set_states(recovered, immunity)
+        active = active[states[active] == infected_code]
+
+    return node_states.infected_count()
@@ -0,0 +1,273 @@
+import numpy as np
+
+from src.config import ensemble_quantiles
+from src.csr import CSRGraph
+from src.utils import err_suffix
+
+
+class Welford:
+    """
+    Running count, mean and variance of a stream of values, with Welford's algorithm
+    A batch of values is merged at once with the pairwise update of Chan et al., so the values are never kept.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x) -> None:
+        """
+        Add a value or an array of values
+
+        :param x: values
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        if len(x):
+            mean = x.mean()
+            self.merge(len(x), mean, float(((x - mean) ** 2).sum()))
+
+    def merge(self, count: int, mean: float, m2: float) -> None:
+        """
+        Merge the moments of another stream of values
+
+        :param count: number of values
+        :param mean: mean of the values
+        :param m2: sum of the squared deviations from the mean
+        """
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    @property
+    def variance(self) -> float:
+        """
+        :return: return the sample variance, nan with less than two values
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def sem(self) -> float:
+        """
+        :return: return the standard error of the mean, nan with less than two values
+        """
+        return np.sqrt(self.variance / self.count) if self.count > 1 else np.nan
+
+
+class P2Quantile:
+    """
+    Running estimate of a quantile of a stream of values, with the P² algorithm of Jain and Chlamtac
+    The first exact_size values are kept and their quantile is exact, since with few values the markers are far off.
+    Then only five markers are kept: the minimum, the maximum, the quantile and two quantiles halfway to the ends.
+    Their heights are moved with a piecewise parabolic interpolation as their positions drift from the desired ones.
+    """
+
+    exact_size = 50
+
+    def __init__(self, p: float):
+        """
+        :param p: quantile, between 0 and 1
+        """
+        self.p = p
+        self.values = []
+        self.heights = None
+        self.positions = None
+        self.desired = None
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x) -> None:
+        """
+        Add a value or an array of values, one at a time
+
+        :param x: values
+        """
+        for value in np.asarray(x, dtype=float).ravel().tolist():
+            self.add_value(value)
+
+    def start_markers(self) -> None:
+        """
+        Place the five markers on the kept values, at the integer positions closest to the desired ones
+        """
+        values = sorted(self.values)
+        last = len(values) - 1
+        self.desired = [last * increment for increment in self.increments]
+        self.positions = [0]
+        for desired in self.desired[1:4]:
+            self.positions.append(min(max(round(desired), self.positions[-1] + 1), last - 4 + len(self.positions)))
+        self.positions.append(last)
+        # The inner markers start at the interpolated quantiles, the positions being rounded
+        self.heights = [values[0]] + np.quantile(values, [d / last for d in self.desired[1:4]]).tolist() + [values[-1]]
+        self.values = None
+
+    def add_value(self, x: float) -> None:
+        """
+        Add a value
+
+        :param x: value
+        """
+        if self.heights is None:
+            self.values.append(x)
+            if len(self.values) > self.exact_size:
+                self.start_markers()
+            return
+        q, n = self.heights, self.positions
+
+        # Cell of the value, extending the extreme markers if needed
+        if x < q[0]:
+            q[0] = x
+        elif x > q[4]:
+            q[4] = x
+        k = min(max(np.searchsorted(q, x, side="right") - 1, 0), 3)
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the three inner markers by one position towards their desired position
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] += d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    @property
+    def value(self) -> float:
+        """
+        :return: return the estimate of the quantile, exact up to exact_size values, nan without values
+        """
+        if self.heights is None:
+            return float(np.quantile(self.values, self.p)) if self.values else np.nan
+        return self.heights[2]
+
+
+class Ensemble:
+    """
+    Running statistics of a result over the replicas of a point: mean, standard error and quantiles
+    """
+
+    def __init__(self, quantiles: tuple = ensemble_quantiles):
+        """
+        :param quantiles: quantiles to estimate
+        """
+        self.moments = Welford()
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x) -> None:
+        """
+        Add the value of a replica or an array of values of many replicas
+
+        :param x: values
+        """
+        self.moments.add(x)
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def summary(self, name: str) -> dict:
+        """
+        Get the statistics of the result, see error_keys
+
+        :param name: key of the result
+        :return: return the mean, the standard error and the quantiles by key
+        """
+        summary = {name: self.moments.mean, name + err_suffix: self.moments.sem}
+        for quantile in self.quantiles:
+            summary[quantile_key(name, quantile.p)] = quantile.value
+        return summary
+
+
+def quantile_key(name: str, p: float) -> str:
+    """
+    Get the key of a quantile of a result, like j_pred_q05 for the 5% quantile of j_pred
+
+    :param name: key of the result
+    :param p: quantile
+    :return: return the key of the quantile
+    """
+    return name + "_q" + str(round(100 * p)).zfill(2)
+
+
+def error_keys(name: str, quantiles: tuple = ensemble_quantiles) -> list:
+    """
+    Get the keys of the statistics of a result over the replicas, besides its mean
+
+    :param name: key of the result
+    :param quantiles: quantiles estimated
+    :return: return the key of the standard error and of the quantiles
+    """
+    return [name + err_suffix] + [quantile_key(name, p) for p in quantiles]
+
+
+def ensemble_keys(rows: list, values: list) -> list:
+    """
+    Get the keys of the statistics of the values that the rows of a sweep have, none if they have a single replica
+
+    :param rows: results of the jobs, dicts or None
+    :param values: keys of the results with replicas
+    :return: return the keys of the statistics
+    """
+    row = next((row for row in rows if row is not None), {})
+    return [key for name in values for key in error_keys(name) if key in row]
+
+
+# ______________________________________________________________________________________________________________________
+# Ensemble jobs
+
+
+def ensemble_point(*arguments, rng: np.random.Generator = None) -> dict:
+    """
+    Run the replicas of a job and reduce their results to their statistics, see ensemble_jobs
+    The arguments are the graphs of the job followed by (function, args, replicas, values, graph).
+    Each replica has its own stream spawned from the stream of the job, and a new graph if graph is given.
+    Only the running statistics are kept, the other entries of the result are the ones of the last replica.
+
+    :param arguments: graphs and description of the job
+    :param rng: random generator of the job
+    :return: return the result with the statistics of the values, None if every replica returned None
+    """
+    *graphs, function, args, replicas, values, graph = arguments
+    rng = np.random.default_rng() if rng is None else rng
+    ensembles = {name: Ensemble() for name in values}
+    row = None
+    for replica_rng in rng.spawn(replicas):
+        if graph is not None:
+            graphs = graph(replica_rng)
+            graphs = (graphs,) if isinstance(graphs, CSRGraph) else graphs
+        result = function(*graphs, *args, rng=replica_rng)
+        if result is None:
+            continue
+        # A function returning a number has a single value
+        row = dict(result) if isinstance(result, dict) else {values[0]: result}
+        for name, ensemble in ensembles.items():
+            ensemble.add(row[name])
+    if row is None:
+        return None
+    for name, ensemble in ensembles.items():
+        row.update(ensemble.summary(name))
+    return row
+
+
+def ensemble_jobs(jobs: list, replicas: int, values: list, graph=None) -> list:
+    """
+    Turn each job of a sweep in a job running its replicas in the same worker, see ensemble_point
+    The job returns its result with the mean of each value and its statistics, see Ensemble.summary, and a job
+    returning a number returns a dict with the number under values[0]. With a single replica on the same graph
+    the jobs are returned unchanged.
+
+    :param jobs: jobs of the sweep, see run_sweep
+    :param replicas: number of replicas of each job
+    :param values: keys of the results to reduce over the replicas
+    :param graph: function of the random generator returning a new graph, or tuple of graphs, for each replica
+    :return: return the ensemble jobs
+    """
+    if replicas <= 1 and graph is None:
+        return jobs
+    return [(ensemble_point, keys, (function, args, replicas, values, graph)) for function, keys, args in jobs]
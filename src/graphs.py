@@ -1,76 +1,347 @@
-import random
+import os
 
 import networkx as nx
+import numpy as np
 
-from src.config import init_infect
-from src.infection import init_infected
+from src.cache import touch, evict_lru
+from src.config import init_infect, graph_cache_bytes
+from src.csr import CSRGraph, csr_from_edges, to_csr, to_networkx, segment_rows, save_csr, load_csr
+from src.infection import init_infected, init_infected_mask
+from src.utils import path_graphs
 
 
-def cycle_graph_test(nodes: int = 20) -> (nx.Graph, nx.Graph):
+def cycle_graph_csr(nodes: int) -> CSRGraph:
+    """
+    Create the cycle graph with the given number of nodes, like nx.cycle_graph
+
+    :param nodes: number of nodes
+    :return: CSR graph
+    """
+    src = np.arange(nodes)
+    dst = (src + 1) % nodes
+    if nodes == 2:
+        # The two links of the cycle are the same link
+        src, dst = src[:1], dst[:1]
+    return csr_from_edges(nodes, src, dst)
+
+
+def gnp_random_graph_csr(nodes: int, p: float, rng: np.random.Generator = None) -> CSRGraph:
+    """
+    Create the random graph G(n, p), like nx.gnp_random_graph, in O(n + m)
+    The pairs (i, j) with j < i are numbered i * (i - 1) / 2 + j and the gaps between two consecutive links
+    are geometric, so only the links are drawn instead of a random number for every pair.
+
+    :param nodes: number of nodes
+    :param p: probability of the connection
+    :param rng: random generator
+    :return: CSR graph
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    pairs = nodes * (nodes - 1) // 2
+    if p <= 0 or pairs == 0:
+        return csr_from_edges(nodes, [], [])
+
+    if p >= 1:
+        links = np.arange(pairs)
+    else:
+        chunks = []
+        last = -1
+        while last < pairs:
+            # Enough gaps to reach the last pair most of the times, otherwise draw another chunk
+            expected = (pairs - last) * p
+            gaps = rng.geometric(p, int(expected + 5 * np.sqrt(expected)) + 16)
+            chunks.append(last + np.cumsum(gaps))
+            last = chunks[-1][-1]
+        links = np.concatenate(chunks)
+        links = links[links < pairs]
+
+    # Invert the numbering of the pairs, fixing the rounding of the square root
+    i = ((1 + np.sqrt(1 + 8 * links.astype(float))) // 2).astype(np.int64)
+    i -= i * (i - 1) // 2 > links
+    i += (i + 1) * i // 2 <= links
+    return csr_from_edges(nodes, i, links - i * (i - 1) // 2)
+
+
+def barabasi_albert_graph_csr(nodes: int, m: int, rng: np.random.Generator = None) -> CSRGraph:
+    """
+    Create the scale free graph of Barabasi-Albert, like nx.barabasi_albert_graph
+    The graph starts from a star with m + 1 nodes and each new node links to m distinct nodes chosen uniformly
+    from the repeated nodes array, where every node appears once for each of its links.
+
+    Each new node appends its m targets and m copies of itself, so the length of the array when it arrives
+    is known and its targets can be drawn at once as positions of the array before it. The positions are
+    resolved by pointer jumping and the repeated targets of a node are drawn again.
+
+    :param nodes: number of nodes
+    :param m: number of links of each new node
+    :param rng: random generator
+    :return: CSR graph
+    """
+    if m < 1 or m >= nodes:
+        raise ValueError(f"Barabasi-Albert graph must have m >= 1 and m < nodes, m = {m}, nodes = {nodes}")
+    rng = np.random.default_rng() if rng is None else rng
+
+    new = np.arange(m + 1, nodes)
+    start = 2 * m * (new - m)
+    repeated = np.empty(2 * m * (nodes - m), dtype=np.int64)
+    repeated[:2 * m] = np.concatenate((np.zeros(m, dtype=np.int64), np.arange(1, m + 1)))
+    repeated[start[:, None] + m + np.arange(m)] = new[:, None]
+
+    # The first nodes choose from a short array and often draw the same target, they are added one by one
+    head = min(len(new), 1024)
+    for begin in start[:head]:
+        targets = []
+        while len(targets) < m:
+            target = repeated[rng.integers(begin)]
+            if target not in targets:
+                targets.append(target)
+        repeated[begin:begin + m] = targets
+
+    slots = start[head:, None] + np.arange(m)
+    length = np.broadcast_to(start[head:, None], slots.shape)
+    pointer = np.arange(len(repeated))
+    pointer[slots] = rng.integers(0, length)
+    earlier = np.tri(m, k=-1, dtype=bool)
+    while True:
+        # Follow the positions until a node already chosen, every jump halves the remaining path
+        resolved = pointer.copy()
+        while True:
+            jumped = resolved[resolved]
+            if np.array_equal(jumped, resolved):
+                break
+            resolved = jumped
+        targets = repeated[resolved[slots]]
+
+        # A target already chosen by the same node is chosen again, as in the rejection of nx
+        duplicated = ((targets[:, :, None] == targets[:, None, :]) & earlier).any(axis=2)
+        if not duplicated.any():
+            break
+        pointer[slots[duplicated]] = rng.integers(0, length[duplicated])
+    repeated[slots] = targets
+
+    src = np.concatenate((np.zeros(m, dtype=np.int64), np.repeat(new, m)))
+    dst = np.concatenate((np.arange(1, m + 1), repeated[start[:, None] + np.arange(m)].ravel()))
+    return csr_from_edges(nodes, src, dst)
+
+
+def configuration_model_csr(degrees: np.ndarray, rng: np.random.Generator = None) -> CSRGraph:
+    """
+    Create a random graph with the given degree sequence, like nx.configuration_model
+    The stubs of the nodes are shuffled and paired, so the graph can have self loops and multiple links.
+
+    :param degrees: degree of each node, their sum must be even
+    :param rng: random generator
+    :return: CSR graph
+    """
+    degrees = np.asarray(degrees, dtype=np.int64)
+    if degrees.sum() % 2:
+        raise ValueError("The sum of the degrees must be even")
+    rng = np.random.default_rng() if rng is None else rng
+    stubs = rng.permutation(np.repeat(np.arange(len(degrees)), degrees))
+    return csr_from_edges(len(degrees), stubs[0::2], stubs[1::2])
+
+
+def generate_graph(family: str, nodes: int, param: float = None, rng: np.random.Generator = None) -> CSRGraph:
+    """
+    Generate a graph of a family, partial(generate_graph, family, nodes, param) is a picklable generator of rng
+
+    :param family: generator of the graph, "cycle", "gnp" (param is p) or "ba" (param is m)
+    :param nodes: number of nodes
+    :param param: parameter of the generator
+    :param rng: random generator
+    :return: CSR graph
+    """
+    generators = {
+        "cycle": lambda: cycle_graph_csr(nodes),
+        "gnp": lambda: gnp_random_graph_csr(nodes, param, rng),
+        "ba": lambda: barabasi_albert_graph_csr(nodes, param, rng),
+    }
+    return generators[family]()
+
+
+def cached_graph(family: str, nodes: int, param: float = None, seed=None) -> CSRGraph:
+    """
+    Get a generated graph from the cache of the graphs, generating and saving it the first time
+    The graphs are saved by (family, nodes, param, seed) and loaded memory mapped. When the cache is larger than
+    graph_cache_bytes the least recently used graphs are removed. Without a seed the graph is never cached.
+
+    :param family: generator of the graph, "cycle", "gnp" (param is p) or "ba" (param is m)
+    :param nodes: number of nodes
+    :param param: parameter of the generator
+    :param seed: seed of the generator, an int or a tuple of ints
+    :return: CSR graph
+    """
+    if seed is None:
+        return generate_graph(family, nodes, param)
+
+    seeds = seed if isinstance(seed, tuple) else (seed,)
+    name = family + "-n" + str(nodes) + "-p" + str(param) + "-s" + "_".join(str(s) for s in seeds)
+    path = os.path.join(path_graphs, name)
+    if not os.path.isdir(path):
+        save_csr(generate_graph(family, nodes, param, np.random.default_rng(seeds)), path)
+    touch(path)
+    evict_lru(path_graphs, graph_cache_bytes)
+    return load_csr(path)
+
+
+def cycle_graph_csr_test(nodes: int = 20, seed: int = None) -> (CSRGraph, CSRGraph, np.ndarray):
+    """
+    Test the cycle graph with CSR graphs
+
+    :param nodes: number of nodes
+    :param seed: seed of the initial infected nodes
+    :return: Physical and Virtual graph and the initial infected nodes
+    """
+    PG = cached_graph("cycle", nodes, seed=seed)
+    rng = np.random.default_rng(None if seed is None else (seed, 2))
+    return PG, PG, init_infected_mask(nodes, init_infect, rng)
+
+
+def scale_free_graph_csr_test(nodes: int = 20,
+                              mPG: int = 6,
+                              mVG: int = 6,
+                              seed: int = None) -> (CSRGraph, CSRGraph, np.ndarray):
+    """
+    Test the scale free graph with CSR graphs
+
+    :param nodes: number of nodes
+    :param mPG: average degree of the physical graph
+    :param mVG: average degree of the virtual graph
+    :param seed: seed of the graphs and of the initial infected nodes, new graphs are generated if None
+    :return: Physical and Virtual graph and the initial infected nodes
+    """
+    PG = cached_graph("ba", nodes, mPG, None if seed is None else (seed, 0))
+    VG = cached_graph("ba", nodes, mVG, None if seed is None else (seed, 1))
+    rng = np.random.default_rng(None if seed is None else (seed, 2))
+    return PG, VG, init_infected_mask(nodes, init_infect, rng)
+
+
+def random_graph_csr_test(nodes: int = 20,
+                          pPG: float = 0.5,
+                          pVG: float = 0.5,
+                          seed: int = None) -> (CSRGraph, CSRGraph, np.ndarray):
+    """
+    Test the random graph with CSR graphs
+
+    :param nodes: number of nodes
+    :param pPG: probability of the connection in the physical graph
+    :param pVG: probability of the connection in the virtual graph
+    :param seed: seed of the graphs and of the initial infected nodes, new graphs are generated if None
+    :return: Physical and Virtual graph and the initial infected nodes
+    """
+    PG = cached_graph("gnp", nodes, pPG, None if seed is None else (seed, 0))
+    VG = cached_graph("gnp", nodes, pVG, None if seed is None else (seed, 1))
+    rng = np.random.default_rng(None if seed is None else (seed, 2))
+    return PG, VG, init_infected_mask(nodes, init_infect, rng)
+
+
+def cycle_graph_test(nodes: int = 20, seed: int = None) -> (nx.Graph, nx.Graph):
     """
     Test the cycle graph
 
     :param nodes: number of nodes
+    :param seed: seed of the initial infected nodes, the same as in cycle_graph_csr_test
     :return: Physical and Virtual graph
     """
-    PG = nx.cycle_graph(nodes)
-    VG = nx.cycle_graph(nodes)
-    init_infected(PG, init_infect)
+    PG = to_networkx(cycle_graph_csr(nodes))
+    VG = to_networkx(cycle_graph_csr(nodes))
+    init_infected(PG, init_infect, np.random.default_rng(None if seed is None else (seed, 2)))
     return PG, VG
 
 
-def scale_free_graph_test(nodes: int = 20, mPG: int = 6, mVG: int = 6) -> (nx.Graph, nx.Graph):
+def scale_free_graph_test(nodes: int = 20, mPG: int = 6, mVG: int = 6, seed: int = None) -> (nx.Graph, nx.Graph):
     """
     Test the scale free graph
 
     :param nodes: number of nodes
     :param mPG: average degree of the physical graph
     :param mVG: average degree of the virtual graph
+    :param seed: seed of the graphs and of the initial infected nodes, the same as in scale_free_graph_csr_test
     :return: Physical and Virtual graph
     """
-    PG = nx.barabasi_albert_graph(nodes, mPG)
-    VG = nx.barabasi_albert_graph(nodes, mVG)
-    init_infected(PG, init_infect)
+    rngs = [np.random.default_rng(None if seed is None else (seed, i)) for i in range(3)]
+    PG = to_networkx(barabasi_albert_graph_csr(nodes, mPG, rngs[0]))
+    VG = to_networkx(barabasi_albert_graph_csr(nodes, mVG, rngs[1]))
+    init_infected(PG, init_infect, rngs[2])
     return PG, VG
 
 
-def random_graph_test(nodes: int = 20, pPG: float = 0.5, pVG: float = 0.5) -> (nx.Graph, nx.Graph):
+def random_graph_test(nodes: int = 20,
+                      pPG: float = 0.5,
+                      pVG: float = 0.5,
+                      seed: int = None) -> (nx.Graph, nx.Graph):
     """
     Test the random graph
 
     :param nodes: number of nodes
     :param pPG: probability of the connection in the physical graph
     :param pVG: probability of the connection in the virtual graph
+    :param seed: seed of the graphs and of the initial infected nodes, the same as in random_graph_csr_test
     :return: Physical and Virtual graph
     """
-    PG = nx.gnp_random_graph(nodes, pPG)
-    VG = nx.gnp_random_graph(nodes, pVG)
-    init_infected(PG, init_infect)
+    rngs = [np.random.default_rng(None if seed is None else (seed, i)) for i in range(3)]
+    PG = to_networkx(gnp_random_graph_csr(nodes, pPG, rngs[0]))
+    VG = to_networkx(gnp_random_graph_csr(nodes, pVG, rngs[1]))
+    init_infected(PG, init_infect, rngs[2])
     return PG, VG
 
 
-def get_information_graph(PG: nx.Graph, VG: nx.Graph, q: float = 0.5) -> nx.DiGraph:
+def get_information_graph(PG: nx.Graph, VG: nx.Graph, q: float = 0.5, rng: np.random.Generator = None) -> nx.DiGraph:
     """
     Create the information graph from the two graphs Physical and Virtual graph
 
     :param PG: Physical graph
     :param VG: Virtual graph
     :param q: q value
+    :param rng: random generator of the links
     :return: return the information graph
     """
+    nodes = list(PG.nodes())
+    PG, VG = to_csr(PG, nodes), to_csr(VG, nodes)
+    csr = get_information_graph_csr(PG, VG, q, information_graph_draws(PG, VG, rng))
+
     IG = nx.DiGraph()
+    IG.add_nodes_from(nodes)
+    for node, neighbors in zip(nodes, np.split(csr.indices, csr.indptr[1:-1])):
+        IG.add_edges_from((node, nodes[neighbor]) for neighbor in neighbors)
+    return IG
+
+
+def information_graph_draws(PG: CSRGraph, VG: CSRGraph, rng: np.random.Generator = None) -> tuple:
+    """
+    Draw the random numbers of the information graph, one for each directed edge of PG and VG
+
+    :param PG: Physical graph
+    :param VG: Virtual graph
+    :param rng: random generator
+    :return: return the random numbers of the edges of PG and of VG
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    return rng.random(len(PG.indices)), rng.random(len(VG.indices))
 
-    for node in PG.nodes():
-        IG.add_node(node)
 
-        # Add outgoing links from the physical graph with probability 1 - q
-        for neighbor in PG.neighbors(node):
-            if random.random() > q:
-                IG.add_edge(node, neighbor)
+def get_information_graph_csr(PG: CSRGraph, VG: CSRGraph, q: float = 0.5, draws: tuple = None) -> CSRGraph:
+    """
+    Create the information graph from the two CSR graphs Physical and Virtual graph, sharing the node index
+    The outgoing links of PG are kept if their random number is > q, the links of VG if it is <= q.
+    Passing the same draws for all the values of q gives coupled information graphs, the links of PG
+    only disappear and the links of VG only appear as q grows.
 
-        # Add links from the virtual graph with probability q
-        for neighbor in VG.neighbors(node):
-            if random.random() <= q:
-                IG.add_edge(node, neighbor)
+    :param PG: Physical graph
+    :param VG: Virtual graph
+    :param q: q value
+    :param draws: random numbers of the edges from information_graph_draws, drawn now if not given
+    :return: return the information graph
+    """
+    r_pg, r_vg = information_graph_draws(PG, VG) if draws is None else draws
+    keep_pg = r_pg > q
+    keep_vg = r_vg <= q
 
-    return IG
+    src = np.concatenate((segment_rows(PG)[keep_pg], segment_rows(VG)[keep_vg]))
+    dst = np.concatenate((PG.indices[keep_pg], VG.indices[keep_vg]))
+    # The links in both graphs are added once, the sorted keys are already in CSR order
+    edges = np.unique(src * PG.n_nodes + dst)
+    degree = np.bincount(edges // PG.n_nodes, minlength=PG.n_nodes)
+    indptr = np.zeros(PG.n_nodes + 1, dtype=np.int64)
+    np.cumsum(degree, out=indptr[1:])
+    return CSRGraph(indptr, (edges % PG.n_nodes).astype(np.int32), degree)
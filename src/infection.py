@@ -1,10 +1,10 @@
-import random
+from functools import lru_cache
 
 import networkx as nx
 import numpy as np
-import random as rd
 
-from src.config import eps
+from src.config import eps, table_max_degree, table_cache_size
+from src.csr import CSRGraph, neighbor_count
 from src.utils import *
 
 
@@ -76,14 +76,123 @@ def prob_being_infected(s: int, k: int, tau: float, J: float) -> float:
     return 1 - pow(1-infected_prob(s, k, tau, J), s)
 
 
-def init_infected(G: nx.Graph, n: int = 1) -> None:
+def risk_perception_array(k: np.ndarray, si: np.ndarray, r: np.ndarray, tau: float) -> np.ndarray:
+    """
+    Compute the risk perception element-wise, see risk_perception
+
+    :param k: degrees
+    :param si: numbers of infected neighbors
+    :param r: random numbers
+    :param tau: infection probability
+    :return: risk perceptions
+    """
+    tau = max(tau, eps)
+    si = np.maximum(si, eps)
+    jc = -(k / si) * np.log(r / tau)
+    return np.maximum(jc, 0)
+
+
+def infected_prob_array(s: np.ndarray, k: np.ndarray, t: np.ndarray, J: np.ndarray) -> np.ndarray:
+    """
+    Compute the probability of being infected element-wise, see infected_prob
+
+    :param s: numbers of infected neighbors
+    :param k: degrees of the nodes
+    :param t: bare infection probability, scalar or array broadcasting with s
+    :param J: perception risk, scalar or array broadcasting with s
+    :return: probabilities of being infected
+    """
+    t = np.maximum(t, eps)
+    J = np.maximum(J, eps)
+    k = np.maximum(k, eps)
+    u = t * np.exp(-J * s / k)
+    return np.maximum(u, 0)
+
+
+def prob_being_infected_array(s: np.ndarray, k: np.ndarray, tau: np.ndarray, J: np.ndarray) -> np.ndarray:
+    """
+    Compute the probability of being infected element-wise, see prob_being_infected
+
+    :param s: numbers of infected neighbors
+    :param k: degrees of the nodes
+    :param tau: bare infection probability, scalar or array broadcasting with s
+    :param J: perception risk, scalar or array broadcasting with s
+    :return: probabilities of being infected
+    """
+    return 1 - (1 - infected_prob_array(s, k, tau, J)) ** s
+
+
+# ______________________________________________________________________________________________________________________
+# Lookup tables, s and k are small integers so p(s, k) is computed once for all of them
+
+
+@lru_cache(maxsize=table_cache_size)
+def infection_table(tau: float, J: float, approx: bool = False) -> np.ndarray:
+    """
+    Get the table of the probabilities of being infected, table[k, s] = p(s, k) for s, k <= table_max_degree
+    The tables of the last table_cache_size (tau, J) values are kept, the least recently used are discarded.
+
+    :param tau: bare infection probability
+    :param J: perception risk
+    :param approx: table of the approximation s * u(s, k) instead of p(s, k)
+    :return: read only table of the probabilities
+    """
+    k = np.arange(table_max_degree + 1)[:, np.newaxis]
+    s = np.arange(table_max_degree + 1)[np.newaxis, :]
+    table = s * infected_prob_array(s, k, tau, J) if approx else prob_being_infected_array(s, k, tau, J)
+    table.flags.writeable = False
+    return table
+
+
+def lookup(table: np.ndarray, s: np.ndarray, k: np.ndarray, direct) -> np.ndarray:
+    """
+    Gather table[k, s] element-wise, computing direct(s, k) for the degrees larger than the table
+
+    :param table: lookup table
+    :param s: numbers of infected neighbors
+    :param k: degrees of the nodes
+    :param direct: function computing the values of the larger degrees
+    :return: values of the table
+    """
+    s = np.asarray(s, dtype=np.int64)
+    k = np.broadcast_to(np.asarray(k, dtype=np.int64), s.shape)
+    small = k <= table_max_degree
+    if small.all():
+        return table[k, s]
+    values = np.empty(s.shape)
+    values[small] = table[k[small], s[small]]
+    values[~small] = direct(s[~small], k[~small])
+    return values
+
+
+def prob_being_infected_lookup(s: np.ndarray, k: np.ndarray, tau: float, J: float, approx: bool = False):
+    """
+    Compute the probability of being infected element-wise from the lookup table, see prob_being_infected_array
+
+    :param s: numbers of infected neighbors
+    :param k: degrees of the nodes
+    :param tau: bare infection probability
+    :param J: perception risk
+    :param approx: the approximation s * u(s, k) instead of p(s, k)
+    :return: probabilities of being infected
+    """
+    if approx:
+        direct = lambda s, k: s * infected_prob_array(s, k, tau, J)
+    else:
+        direct = lambda s, k: prob_being_infected_array(s, k, tau, J)
+    return lookup(infection_table(float(tau), float(J), approx), s, k, direct)
+
+
+def init_infected(G: nx.Graph, n: int = 1, rng: np.random.Generator = None) -> None:
     """
     Initialize the graph G with n infected nodes
 
     :param G: graph
     :param n: number of infected nodes, default 1
+    :param rng: random generator
     """
-    infected_nodes = set(rd.sample(range(G.number_of_nodes()), n))
+    rng = np.random.default_rng() if rng is None else rng
+    infected_nodes = set(rng.choice(G.number_of_nodes(), size=n, replace=False).tolist())
     for node in G.nodes:
         G.nodes[node][state] = infected if node in infected_nodes else healthy
 
@@ -102,6 +211,28 @@ def get_infected(G: nx.Graph, states: dict = None) -> int:
         return sum(G.nodes[node][state] == infected for node in G.nodes)
 
 
+def get_infected_mask(G: nx.Graph) -> np.ndarray:
+    """
+    Get the infected nodes of the graph G as a boolean array, in the order of G.nodes()
+
+    :param G: graph
+    :return: return True for the infected nodes
+    """
+    return np.array([G.nodes[node][state] == infected for node in G.nodes], dtype=bool)
+
+
+def init_infected_mask(nodes: int, n: int = 1, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Choose n infected nodes out of nodes as a boolean array, like init_infected for the CSR graphs
+
+    :param nodes: number of nodes
+    :param n: number of infected nodes, default 1
+    :param rng: random generator
+    :return: return True for the infected nodes
+    """
+    return init_infected_array(nodes, n, rng) == infected_code
+
+
 def get_percentage_infected(G: nx.Graph, states: dict = None) -> float:
     """
     Compute the percentage of infected nodes in the graph G
@@ -156,28 +287,150 @@ def update_risk(G: nx.Graph, J: float, t: float) -> None:
         #G.nodes[node][risk] = infected_prob(s, k, t, J)
 
 
-def new_infected(G: nx.Graph) -> None:
+def new_infected(G: nx.Graph, rng: np.random.Generator = None) -> None:
     """
     Propagate the disease in the graph G with infected probability
 
     :param G: graph
+    :param rng: random generator
     """
+    rng = np.random.default_rng() if rng is None else rng
     for node in G.nodes:
-        u = G.nodes[node][state]
-        r = random.random()
+        u = G.nodes[node][risk]
+        r = rng.random()
         if r < u and G.nodes[node][state] == healthy:
             G.nodes[node][state] = infected
 
 
-def change_state(G: nx.Graph, rec_prob: float, new_state: str) -> None:
+def change_state(G: nx.Graph, rec_prob: float, new_state: str, rng: np.random.Generator = None) -> None:
     """
     Change the state of all nodes in the graph G
 
     :param G: graph
     :param rec_prob: recovery probability
     :param new_state: new state
+    :param rng: random generator
     """
+    rng = np.random.default_rng() if rng is None else rng
     for node in G.nodes:
-        r = random.random()
+        r = rng.random()
         if G.nodes[node][state] == infected and r < rec_prob:
             G.nodes[node][state] = new_state
+
+
+# ______________________________________________________________________________________________________________________
+# Node states as uint8 arrays, the code of the state of node i is states[i], see state_codes
+
+
+def init_infected_array(nodes: int, n: int = 1, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Initialize the states of the nodes with n infected nodes, see init_infected
+
+    :param nodes: number of nodes
+    :param n: number of infected nodes, default 1
+    :param rng: random generator
+    :return: return the states of the nodes
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    states = np.full(nodes, healthy_code, dtype=np.uint8)
+    states[rng.choice(nodes, n, replace=False)] = infected_code
+    return states
+
+
+def get_states_array(G: nx.Graph) -> np.ndarray:
+    """
+    Get the states of the nodes of the graph G as codes, in the order of G.nodes()
+
+    :param G: graph
+    :return: return the states of the nodes
+    """
+    return np.array([state_codes[G.nodes[node][state]] for node in G.nodes], dtype=np.uint8)
+
+
+def set_states_array(G: nx.Graph, states: np.ndarray) -> None:
+    """
+    Set the states of the nodes of the graph G from their codes, in the order of G.nodes()
+
+    :param G: graph
+    :param states: states of the nodes
+    """
+    names = {code: name for name, code in state_codes.items()}
+    for node, code in zip(G.nodes, states.tolist()):
+        G.nodes[node][state] = names[code]
+
+
+def get_infected_array(states: np.ndarray) -> int:
+    """
+    Count the number of infected nodes, see get_infected
+
+    :param states: states of the nodes
+    :return: return the number of infected nodes
+    """
+    return np.count_nonzero(states == infected_code)
+
+
+def get_percentage_infected_array(states: np.ndarray) -> float:
+    """
+    Compute the percentage of infected nodes, see get_percentage_infected
+
+    :param states: states of the nodes
+    :return: return the percentage of infected nodes
+    """
+    return get_infected_array(states) / len(states)
+
+
+def get_infected_neighbors_array(G: CSRGraph, states: np.ndarray, block_size: int = None) -> np.ndarray:
+    """
+    Count the number of infected neighbors of every node of the CSR graph G, see get_infected_neighbors
+
+    :param G: CSR graph
+    :param states: states of the nodes
+    :param block_size: number of nodes of each block, see node_blocks
+    :return: return the number of infected neighbors of each node
+    """
+    return neighbor_count(G, states == infected_code, block_size)
+
+
+def update_risk_array(G: CSRGraph, states: np.ndarray, J: float, t: float) -> np.ndarray:
+    """
+    Evaluate the risk perception of every node of the CSR graph G, see update_risk
+
+    :param G: CSR graph
+    :param states: states of the nodes
+    :param J: perception risk
+    :param t: bare infection probability
+    :return: return the probability of being infected of each node
+    """
+    return prob_being_infected_array(get_infected_neighbors_array(G, states), G.degree, t, J)
+
+
+def new_infected_array(states: np.ndarray, risk: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Propagate the disease, a healthy node is infected with probability risk, see new_infected
+
+    :param states: states of the nodes, updated in place
+    :param risk: probability of being infected of each node
+    :param rng: random generator
+    :return: return the states of the nodes
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    states[(rng.random(len(states)) < risk) & (states == healthy_code)] = infected_code
+    return states
+
+
+def change_state_array(states: np.ndarray,
+                       rec_prob: float,
+                       new_state: int,
+                       rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Change the state of the infected nodes with probability rec_prob, see change_state
+
+    :param states: states of the nodes, updated in place
+    :param rec_prob: recovery probability
+    :param new_state: code of the new state
+    :param rng: random generator
+    :return: return the states of the nodes
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    states[(rng.random(len(states)) < rec_prob) & (states == infected_code)] = new_state
+    return states
@@ -0,0 +1,126 @@
+import numpy as np
+
+from src.config import eps
+
+# numba is optional, without it the kernels below are plain Python and the NumPy versions are used instead
+try:
+    import numba
+except ImportError:
+    numba = None
+
+jit_available = numba is not None
+
+# Number of information neighbors above which critical_j_sweep sorts their J values instead of counting directly
+sort_degree = 256
+
+
+def njit(function):
+    """
+    Compile the function with numba, caching the machine code on disk, or return it unchanged without numba
+
+    :param function: kernel
+    :return: compiled kernel
+    """
+    return numba.njit(cache=True)(function) if jit_available else function
+
+
+def use_jit(backend: str) -> bool:
+    """
+    Check if the kernels should run with numba
+
+    :param backend: "numba" or "numpy"
+    :return: return True if the backend is numba and it is installed
+    """
+    return backend == "numba" and jit_available
+
+
+@njit
+def simple_percolation_sweep(indptr: np.ndarray, indices: np.ndarray, x: np.ndarray, r: np.ndarray,
+                             tau: float) -> np.ndarray:
+    """
+    Sweep of the simple percolation, node i is infected if an infected neighbor j transmits with r[edge] < tau
+
+    :param indptr: CSR index pointer
+    :param indices: CSR indices
+    :param x: infected nodes before the sweep
+    :param r: random number of each edge
+    :param tau: infection probability
+    :return: infected nodes after the sweep
+    """
+    n = len(indptr) - 1
+    result = np.zeros(n, dtype=np.bool_)
+    for i in range(n):
+        for e in range(indptr[i], indptr[i + 1]):
+            if x[indices[e]] and r[e] < tau:
+                result[i] = True
+                break
+    return result
+
+
+@njit
+def tau_percolation_sweep(indptr: np.ndarray, indices: np.ndarray, tau: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """
+    Sweep of the tau percolation, tau[i] = min over the neighbors j of max(r[edge], tau[j]), 1 without neighbors
+
+    :param indptr: CSR index pointer
+    :param indices: CSR indices
+    :param tau: tau values before the sweep
+    :param r: random number of each edge
+    :return: tau values after the sweep
+    """
+    n = len(indptr) - 1
+    result = np.ones(n)
+    for i in range(n):
+        for e in range(indptr[i], indptr[i + 1]):
+            value = max(r[e], tau[indices[e]])
+            if value < result[i]:
+                result[i] = value
+    return result
+
+
+@njit
+def critical_j_sweep(indptr: np.ndarray, indices: np.ndarray, info_indptr: np.ndarray, info_indices: np.ndarray,
+                     j_values: np.ndarray, r: np.ndarray, tau: float) -> np.ndarray:
+    """
+    Sweep of the critical J percolation, J[i] = max over the neighbors j of min(J[j], -(k / s) * log(r[edge] / tau))
+    s is the number of information neighbors of i with J >= J[j]. Their J values are copied in a buffer and counted
+    directly, O(k^2) on contiguous memory is faster than sorting them up to sort_degree neighbors, above that they are
+    sorted and counted with a binary search. For critic_j_percolation the information graph is the graph itself.
+
+    :param indptr: CSR index pointer of the physical graph
+    :param indices: CSR indices of the physical graph
+    :param info_indptr: CSR index pointer of the information graph
+    :param info_indices: CSR indices of the information graph
+    :param j_values: J values before the sweep
+    :param r: random number of each edge of the physical graph
+    :param tau: infection probability
+    :return: J values after the sweep
+    """
+    n = len(indptr) - 1
+    result = np.zeros(n)
+    tau = max(tau, eps)
+    info = np.empty(max(1, (info_indptr[1:] - info_indptr[:-1]).max()) if n else 1)
+    for i in range(n):
+        degree = info_indptr[i + 1] - info_indptr[i]
+        for f in range(degree):
+            info[f] = j_values[info_indices[info_indptr[i] + f]]
+        if degree > sort_degree:
+            info[:degree].sort()
+
+        k = indptr[i + 1] - indptr[i]
+        best = 0.0
+        for e in range(indptr[i], indptr[i + 1]):
+            cj = j_values[indices[e]]
+            if degree > sort_degree:
+                s = degree - np.searchsorted(info[:degree], cj)
+            else:
+                s = 0
+                for f in range(degree):
+                    if info[f] >= cj:
+                        s += 1
+            jp = max(-(k / max(s, eps)) * np.log(r[e] / tau), 0.0)
+            value = min(cj, jp)
+            if value > best:
+                best = value
+        result[i] = best
+    return result
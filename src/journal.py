@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.memo import memo_config, source_hash
+from src.seeding import canonical_key
+
+
+def journal_key(key, seed: int, fingerprints: tuple = ()) -> str:
+    """
+    Get the key of a job in the journal, from the key of its random stream and the master seed, see run_sweep
+    The fingerprints of its graphs, the configuration values read by the kernels and their source are part of the key,
+    so a sweep never resumes from the results of other graphs, like the new graphs drawn without a graph seed,
+    or of other kernels.
+
+    :param key: key of the job
+    :param seed: master seed
+    :param fingerprints: fingerprints of the graphs of the job, see graph_fingerprint
+    :return: return the key of the job in the journal
+    """
+    key = (key, seed, fingerprints, memo_config, source_hash())
+    return hashlib.blake2b(canonical_key(key).encode(), digest_size=16).hexdigest()
+
+
+def to_json(value):
+    """
+    Convert the numpy values of a result to the Python values written in the journal
+
+    :param value: numpy scalar or array
+    :return: return the Python value
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Result of type {type(value).__name__} can not be written in the journal")
+
+
+def append_journal(path: str, key: str, result) -> None:
+    """
+    Append the result of a job to the journal, one JSON line written with a single append and synced to disk
+    A crash can only leave the last line incomplete, see repair_journal.
+
+    :param path: file of the journal
+    :param key: key of the job, see journal_key
+    :param result: result of the job, numbers, strings, lists and dicts of them, or None
+    """
+    line = (json.dumps({"key": key, "result": result}, default=to_json) + "\n").encode()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        written = 0
+        while written < len(line):
+            written += os.write(fd, line[written:])
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def repair_journal(path: str) -> None:
+    """
+    Remove the incomplete last line left by a crash while appending, so the next appends start on a new line
+
+    :param path: file of the journal
+    """
+    if not os.path.isfile(path):
+        return
+    with open(path, "rb+") as file:
+        data = file.read()
+        if data and not data.endswith(b"\n"):
+            file.truncate(data.rfind(b"\n") + 1)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def read_journal(path: str) -> dict:
+    """
+    Read the results of the completed jobs of a journal, skipping an incomplete last line
+
+    :param path: file of the journal
+    :return: return the results by key of the job, an empty dict if there is no journal
+    """
+    results = {}
+    if not os.path.isfile(path):
+        return results
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[record["key"]] = record["result"]
+    return results
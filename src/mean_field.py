@@ -1,21 +1,138 @@
+import numpy as np
 import scipy
 
-from src.infection import infected_prob
+from src.config import zero_threshold
+from src.convergence import ConvergenceMonitor
+from src.infection import infected_prob, infected_prob_array, get_critical_j
+from src.utils import t_test, j_test, j_pred
 
 
-def simulated_mean_field_infection(k: int, tau: float, c: float, T: int, J: float) -> float:
+def simulated_mean_field_infection(k: int,
+                                   tau: float,
+                                   c: float,
+                                   T: int,
+                                   J: float,
+                                   monitor: ConvergenceMonitor = None) -> float:
     """
     Simulated mean field infection
     Function to simulate the evolution of an infection through mean field approximation
+    The iterations stop early when the monitor detects c = 0 or a stationary c.
 
     :param k: degree of the graph
     :param tau: bare infection probability
     :param c: initial percentage of infected nodes
     :param T: iteration
     :param J: perception risk
+    :param monitor: convergence monitor of the percentage of infected nodes
     :return: return of the percentage of infected nodes
     """
+    monitor = ConvergenceMonitor() if monitor is None else monitor
     for _ in range(T):
         c = abs(sum(scipy.special.binom(k, s) * (c ** s) * ((1 - c) ** (k - s)) * s * infected_prob(s, k, tau, J)
                     for s in range(k)))
+        if monitor.update(c):
+            break
     return c
+
+
+def mean_field_weights(k: int, ts: np.ndarray, js: np.ndarray) -> np.ndarray:
+    """
+    Precompute the terms of the mean field map that do not depend on c:
+    {binom(k, s) * s * u(s, k)} for s = 0 ... k-1
+
+    :param k: degree of the graph
+    :param ts: bare infection probabilities
+    :param js: perception risks, broadcasting with ts
+    :return: return the weights, with shape broadcast(ts, js) + (k,)
+    """
+    s = np.arange(k)
+    ts = np.asarray(ts, dtype=float)[..., np.newaxis]
+    js = np.asarray(js, dtype=float)[..., np.newaxis]
+    return scipy.special.binom(k, s) * s * infected_prob_array(s, k, ts, js)
+
+
+def mean_field_map(c: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Evaluate the mean field map of simulated_mean_field_infection for arrays of c and weights
+    {sum_s binom(k, s) * c^s * (1 - c)^(k - s) * s * u(s, k)}
+
+    :param c: percentages of infected nodes, broadcasting with weights[..., 0]
+    :param weights: weights from mean_field_weights
+    :return: return the percentage of infected nodes after one iteration
+    """
+    k = weights.shape[-1]
+    s = np.arange(k)
+    c = np.asarray(c, dtype=float)[..., np.newaxis]
+    return np.abs(np.sum(weights * c ** s * (1 - c) ** (k - s), axis=-1))
+
+
+def mean_field_fixed_point(k: int,
+                           ts: np.ndarray,
+                           js: np.ndarray,
+                           c: float,
+                           grid: int = 256,
+                           steps: int = 50) -> np.ndarray:
+    """
+    Solve the fixed point of the mean field infection for all the pairs of ts and js at once
+
+    If the map sends c above itself the iteration grows towards the first fixed point above c: it is bracketed
+    on a grid of percentages between c and 1, where the map crosses the percentage since at 1 it is always 0,
+    and refined by bisection.
+    Otherwise the infection dies out and the fixed point is 0.
+
+    :param k: degree of the graph
+    :param ts: values of tau
+    :param js: values of risk perception J
+    :param c: initial percentage of infected nodes
+    :param grid: number of points of the bracketing grid
+    :param steps: number of bisection steps
+    :return: return the fixed point for each (tau, J), with shape (len(ts), len(js))
+    """
+    tt, jj = np.meshgrid(ts, js, indexing="ij")
+    weights = mean_field_weights(k, tt, jj)
+
+    alive = mean_field_map(c, weights) > c
+    low = np.full(tt.shape, float(c))
+    high = np.full(tt.shape, np.nan)
+
+    # Bracketing: first point of the grid where the map is not above the percentage
+    cs = np.linspace(c, 1, grid)
+    for previous, current in zip(cs[:-1], cs[1:]):
+        found = alive & np.isnan(high) & (mean_field_map(current, weights) <= current)
+        low[found] = previous
+        high[found] = current
+
+    # Bisection
+    high[~alive] = c
+    for _ in range(steps):
+        mid = (low + high) / 2
+        above = mean_field_map(mid, weights) > mid
+        low = np.where(above, mid, low)
+        high = np.where(above, high, mid)
+    return np.where(alive, (low + high) / 2, 0)
+
+
+def mean_field_phase_diagram(ks: list, c: float, ts: np.ndarray, js: np.ndarray) -> dict:
+    """
+    Get the critical J values of the mean field for all the degrees, values of tau and J in a single call
+    The critical J of tau is the first value of js with fixed point below the zero threshold.
+
+    :param ks: degrees of the graph
+    :param c: initial percentage of infected nodes
+    :param ts: values of tau
+    :param js: values of risk perception J, in increasing order
+    :return: return the critical J values for each degree
+    """
+    ts = np.asarray(ts)[::-1]
+    js = np.asarray(js)
+    diagrams = {}
+    for k in ks:
+        extinct = mean_field_fixed_point(k, ts, js, c) <= zero_threshold
+        results = {t_test: [], j_test: [], j_pred: []}
+        for t, row in zip(ts, extinct):
+            if row.any():
+                results[t_test].append(t)
+                results[j_test].append(js[np.argmax(row)])
+                results[j_pred].append(get_critical_j(k, t))
+        diagrams[k] = results
+    return diagrams
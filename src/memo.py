@@ -0,0 +1,149 @@
+import hashlib
+import inspect
+import os
+import pickle
+from functools import wraps
+
+import numpy as np
+
+from src.cache import touch, evict_lru
+from src.config import memo_results, memo_cache_bytes, stream_block, eps, conv_tol, conv_window, stall_window, max_j
+from src.csr import CSRGraph
+from src.seeding import canonical_key
+from src.utils import path_memo
+
+# Modules of the kernels and of the functions they call, their source is part of every key so any change to them
+# invalidates the memoized results
+kernel_modules = ("percolation", "csr", "infection", "states", "jit", "convergence")
+kernel_source = None
+
+# Configuration values read by the kernels, part of every key
+memo_config = {"eps": eps, "conv_tol": conv_tol, "conv_window": conv_window, "stall_window": stall_window,
+               "max_j": max_j}
+
+# Fingerprints of the graphs already hashed in this process, by id of their indices with the indices kept alive
+fingerprints = {}
+max_fingerprints = 64
+
+# Bytes written to the cache by this process since it last evicted, the cache is scanned once every evict_share of
+# memo_cache_bytes written instead of at every call, starting full so the first write evicts
+evict_share = 1 / 16
+written = memo_cache_bytes
+
+
+def graph_fingerprint(G: CSRGraph) -> str:
+    """
+    Get the fingerprint of the topology of a CSR graph, the hash of its arrays, computed once for each graph object
+    The arrays are hashed in blocks of stream_block values, so a memory mapped graph is never read in memory at once.
+
+    :param G: CSR graph
+    :return: return the fingerprint of the graph
+    """
+    entry = fingerprints.get(id(G.indices))
+    if entry is not None and entry[0] is G.indices and entry[1] is G.indptr:
+        return entry[2]
+    digest = hashlib.blake2b(digest_size=16)
+    for array in G:
+        digest.update((array.dtype.str + str(array.shape)).encode())
+        for start in range(0, len(array), stream_block):
+            digest.update(np.ascontiguousarray(array[start:start + stream_block]).data)
+    digest = digest.hexdigest()
+    if len(fingerprints) >= max_fingerprints:
+        fingerprints.clear()
+    fingerprints[id(G.indices)] = (G.indices, G.indptr, digest)
+    return digest
+
+
+def source_hash() -> str:
+    """
+    Get the hash of the source of the kernel modules, computed once for each process
+
+    :return: return the hash of the source
+    """
+    global kernel_source
+    if kernel_source is None:
+        digest = hashlib.blake2b(digest_size=16)
+        for module in kernel_modules:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module + ".py"), "rb") as file:
+                digest.update(file.read())
+        kernel_source = digest.hexdigest()
+    return kernel_source
+
+
+def memo_key(function, arguments: dict, state: dict) -> str:
+    """
+    Get the key of a call in the cache, from the function, the source of the kernel modules, its arguments, with the
+    graphs by fingerprint, the state of the random generator and the configuration values read by the kernels
+
+    :param function: memoized function
+    :param arguments: arguments of the call by name, without the random generator
+    :param state: state of the bit generator before the call
+    :return: return the key of the call
+    """
+    values = tuple((name, ("csr", graph_fingerprint(value)) if isinstance(value, CSRGraph) else value)
+                   for name, value in arguments.items())
+    key = (function, source_hash(), values, state, memo_config)
+    return hashlib.blake2b(canonical_key(key).encode(), digest_size=16).hexdigest()
+
+
+def evict(size: int) -> None:
+    """
+    Count the bytes written to the cache and remove the least recently used results once enough have been written
+    The cache can exceed memo_cache_bytes by evict_share of it for each process writing to it.
+
+    :param size: bytes just written
+    """
+    global written
+    written += size
+    if written >= evict_share * memo_cache_bytes:
+        written = 0
+        evict_lru(path_memo, memo_cache_bytes)
+
+
+def memoize(function):
+    """
+    Memoize a simulation kernel taking a random generator rng in a bounded cache on disk
+    The result of a call is stored with the state of the generator after the call, and a call with the same graphs,
+    parameters and generator state loads it and moves the generator to that state, so the callers see the same
+    results and the same following random numbers as if the kernel ran. Only the calls of the same kernel with the
+    same random stream are shared, a job of another sweep has its own stream even when it computes the same thing.
+    The calls without a generator are not reproducible and always run, like the calls with a monitor, which must
+    observe the iterations. When the cache is larger than memo_cache_bytes the least recently used results are
+    removed, see evict.
+
+    :param function: kernel, with a parameter rng
+    :return: return the memoized kernel
+    """
+    signature = inspect.signature(function)
+
+    @wraps(function)
+    def memoized(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        rng = arguments.pop("rng")
+        if not memo_results or rng is None or arguments.get("monitor") is not None:
+            return function(*args, **kwargs)
+
+        path = os.path.join(path_memo, memo_key(function, arguments, rng.bit_generator.state) + ".pkl")
+        try:
+            with open(path, "rb") as file:
+                result, state = pickle.load(file)
+            touch(path)
+            rng.bit_generator.state = state
+            return result
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        result = function(*args, **kwargs)
+        os.makedirs(path_memo, exist_ok=True)
+        temporary = path + ".tmp-" + str(os.getpid())
+        with open(temporary, "wb") as file:
+            pickle.dump((result, rng.bit_generator.state), file)
+            size = file.tell()
+        os.replace(temporary, path)
+        touch(path)
+        evict(size)
+        return result
+
+    return memoized
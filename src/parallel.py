@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from src.config import n_workers, master_seed
+from src.journal import journal_key, append_journal, repair_journal, read_journal
+from src.memo import graph_fingerprint
+from src.seeding import canonical_key, stream_seed, generator
+
+# Graphs shared by the jobs of a sweep, set once in each worker process
+sweep_graphs = {}
+
+
+def init_worker(graphs: dict) -> None:
+    """
+    Set the graphs of the sweep in the current process
+
+    :param graphs: graphs of the sweep by key
+    """
+    sweep_graphs.clear()
+    sweep_graphs.update(graphs)
+
+
+def run_job(job: tuple):
+    """
+    Run a job of the sweep
+    The job is (function, keys, args, seed) and it runs function(*graphs, *args, rng=rng),
+    with the graphs of the keys and a random generator from the seed sequence of the job.
+
+    :param job: job to run
+    :return: return the result of the function
+    """
+    function, keys, args, seed = job
+    return function(*(sweep_graphs[key] for key in keys), *args, rng=generator(seed))
+
+
+def job_keys(jobs: list) -> list:
+    """
+    Get the key of the random stream of each job of a sweep, (function, keys, args, replica)
+    The replica counts the identical jobs before the job, so identical jobs get different streams.
+
+    :param jobs: jobs of the sweep, see run_sweep
+    :return: return the key of each job
+    """
+    replicas = {}
+    keys = []
+    for function, graph_keys, args in jobs:
+        key = (function, graph_keys, args)
+        replica = replicas[canonical_key(key)] = replicas.get(canonical_key(key), -1) + 1
+        keys.append(key + (replica,))
+    return keys
+
+
+def journal_keys(jobs: list, graphs: dict, seed: int) -> list:
+    """
+    Get the key in the journal of each job of a sweep, with the fingerprints of its graphs, see journal_key
+
+    :param jobs: jobs of the sweep, see run_sweep
+    :param graphs: graphs of the sweep by key
+    :param seed: master seed
+    :return: return the key of each job
+    """
+    fingerprints = {key: graph_fingerprint(G) for key, G in graphs.items()}
+    return [journal_key(key, seed, tuple(fingerprints[graph_key] for graph_key in graph_keys))
+            for (_, graph_keys, _), key in zip(jobs, job_keys(jobs))]
+
+
+def run_sweep(jobs: list,
+              graphs: dict = None,
+              seed: int = master_seed,
+              workers: int = n_workers,
+              journal: str = None) -> list:
+    """
+    Run the independent jobs of a sweep on a process pool
+    Each job is (function, keys, args), see run_job. The graphs are sent to each worker once, the jobs only
+    carry their keys. The random stream of each job is keyed by (function, keys, args, replica), see job_keys,
+    so the results are the same in any order and with any number of workers,
+    and the same job gets the same stream in every sweep.
+    With a journal every result is appended to it as soon as its job completes, and the jobs already in the
+    journal are not run again, so an interrupted sweep resumes where it stopped with the same results.
+    The jobs are found in the journal by their graphs and kernels too, see journal_key.
+
+    :param jobs: jobs of the sweep
+    :param graphs: graphs of the sweep by key
+    :param seed: master seed
+    :param workers: number of worker processes, the jobs run in this process if 1
+    :param journal: file of the journal of the sweep, see append_journal, no journal if None
+    :return: return the results of the jobs, in the same order
+    """
+    graphs = {} if graphs is None else graphs
+    names = [None] * len(jobs)
+    done = {}
+    if journal is not None:
+        names = journal_keys(jobs, graphs, seed)
+        repair_journal(journal)
+        done = read_journal(journal)
+    jobs = [(function, graph_keys, args, stream_seed(key, seed))
+            for (function, graph_keys, args), key in zip(jobs, job_keys(jobs))]
+    results = [done.get(name) for name in names]
+    pending = [i for i, name in enumerate(names) if name not in done]
+
+    def complete(i: int, result) -> None:
+        results[i] = result
+        if journal is not None:
+            append_journal(journal, names[i], result)
+
+    if workers <= 1 or len(pending) <= 1:
+        init_worker(graphs)
+        for i in pending:
+            complete(i, run_job(jobs[i]))
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=init_worker,
+                             initargs=(graphs,)) as executor:
+        futures = {executor.submit(run_job, jobs[i]): i for i in pending}
+        for future in as_completed(futures):
+            complete(futures[future], future.result())
+    return results
+
+
+def read_sweep(jobs: list, journal: str, graphs: dict = None, seed: int = master_seed) -> list:
+    """
+    Get the results of the jobs of a sweep from its journal, without running them, see run_sweep
+    The results of a partially complete sweep can be merged and plotted, the rows that are None are skipped
+    by merge_results.
+
+    :param jobs: jobs of the sweep
+    :param journal: file of the journal of the sweep
+    :param graphs: graphs of the sweep by key, the same as in run_sweep
+    :param seed: master seed
+    :return: return the results of the jobs, None for the jobs not completed yet
+    """
+    done = read_journal(journal)
+    return [done.get(name) for name in journal_keys(jobs, {} if graphs is None else graphs, seed)]
+
+
+def split_sweep(results: list, jobs: list) -> list:
+    """
+    Split the results of a sweep run on the concatenation of several lists of jobs
+
+    :param results: results of the sweep
+    :param jobs: lists of jobs, in the order they were concatenated
+    :return: return a list of results for each list of jobs
+    """
+    bounds = np.cumsum([0] + [len(j) for j in jobs])
+    return [results[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def merge_results(rows: list, keys: list) -> dict:
+    """
+    Merge the rows returned by the jobs of a sweep in a dict of results
+    The rows that are None are skipped.
+
+    :param rows: dict of values for each job
+    :param keys: keys of the results
+    :return: return the dict of results
+    """
+    results = {key: [] for key in keys}
+    for row in rows:
+        if row is not None:
+            for key in keys:
+                results[key].append(row[key])
+    return results
@@ -1,44 +1,155 @@
-import random
 import networkx as nx
 import numpy as np
 
-from src.config import max_j
-from src.infection import infected_prob, get_infected_neighbors, risk_perception, \
-    prob_being_infected, get_percentage_infected
+from src.config import max_j, stall_window, table_max_degree, backend
+from src.convergence import ConvergenceMonitor
+from src.csr import CSRGraph, to_csr, adjacency_matrix, segment_rows, segment_reduce, count_greater_equal, \
+    node_blocks
+from src.infection import prob_being_infected, get_infected_mask, risk_perception_array, prob_being_infected_array, \
+    infection_table
+from src.jit import use_jit, simple_percolation_sweep, tau_percolation_sweep, critical_j_sweep
+from src.memo import memoize
+from src.states import NodeStates
 from src.utils import *
 
 # ______________________________________________________________________________________________________________________
 # Simulating the J percolation
 
 
-def simulated_j_percolation(G: nx.Graph, tau: float, J: float, T: int) -> float:
+def simulated_j_percolation(G: nx.Graph,
+                            tau: float,
+                            J: float,
+                            T: int,
+                            vectorized: bool = False,
+                            rng: np.random.Generator = None) -> float:
     """
     Simulated J percolation using the formula for the probability of being infected:
     {1 - (1 - u(s, k))^s} = p(s, k)
-
+    By default the nodes are updated one by one, each seeing the states already updated in the same sweep.
+    The vectorized mode is a synchronous update of all the nodes, much faster but with different dynamics and results.
 
     :param G: graph just infected
     :param tau: bare infection probability
     :param J: risk perception
     :param T: number of iterations
+    :param vectorized: synchronous update of all the nodes at once, otherwise node by node
+    :param rng: random generator, passed to the CSR kernel
     :return: the percentage of infected nodes
     """
-    # Get the states of the nodes
-    states = {node: G.nodes[node][state] for node in G.nodes}
-
+    return simulated_j_percolation_csr(to_csr(G), get_infected_mask(G), tau, J, T, rng=rng, vectorized=vectorized)
+
+
+def simulated_j_percolation_csr(G: CSRGraph,
+                                infected_nodes: np.ndarray,
+                                tau: float,
+                                J: float,
+                                T: int,
+                                rng: np.random.Generator = None,
+                                vectorized: bool = False,
+                                monitor: ConvergenceMonitor = None,
+                                block_size: int = None) -> float:
+    """
+    Simulated J percolation on the CSR graph, see simulated_j_percolation
+
+    In the vectorized mode every sweep is a synchronous update: p(s, k) and the random numbers are computed for all
+    the nodes at once, and the infected neighbors are counted by NodeStates, updating only the neighbors of the
+    nodes whose state changed in the sweep.
+    Otherwise the nodes are updated one by one, each seeing the states already updated in the same sweep.
+    The sweeps stop early when the monitor detects no infected nodes or a stationary percentage.
+    With a block size the infected neighbors are counted one block of nodes at a time, so a memory mapped graph
+    is streamed from disk and only the states of the nodes are kept in memory.
+
+    :param G: CSR graph
+    :param infected_nodes: boolean array of the initially infected nodes
+    :param tau: bare infection probability
+    :param J: risk perception
+    :param T: number of iterations
+    :param rng: random generator
+    :param vectorized: synchronous update of all the nodes at once, otherwise node by node
+    :param monitor: convergence monitor of the percentage of infected nodes
+    :param block_size: number of nodes of each block in the vectorized mode, the whole graph at once if None
+    :return: the percentage of infected nodes
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    monitor = ConvergenceMonitor() if monitor is None else monitor
+    x = np.array(infected_nodes, dtype=bool)
+
+    if vectorized:
+        node_states = NodeStates(G, np.where(x, infected_code, healthy_code), block_size)
+        for _ in range(T):
+            # quenched version
+            x = rng.random(G.n_nodes) < node_states.risk(J, tau)
+            node_states.set_infected(x)
+            if monitor.update(np.count_nonzero(x) / G.n_nodes):
+                break
+        return np.count_nonzero(x) / G.n_nodes
+
+    table = infection_table(float(tau), float(J))
     for _ in range(T):
-        c_states = states
-        for node in G.nodes:
-            k = G.degree(node)
+        r = rng.random(G.n_nodes)
+        for node in range(G.n_nodes):
             # TODO: implementation of the annealed version
-            s = get_infected_neighbors(G, node, c_states)  # quenched version
-            r = random.random()
-            psk = prob_being_infected(s, k, tau, J)
-            states[node] = infected if r < psk else healthy
-    return get_percentage_infected(G, states)
+            s = np.count_nonzero(x[G.indices[G.indptr[node]:G.indptr[node + 1]]])  # quenched version
+            k = G.degree[node]
+            x[node] = r[node] < (table[k, s] if k <= table_max_degree else prob_being_infected(s, k, tau, J))
+        if monitor.update(np.count_nonzero(x) / G.n_nodes):
+            break
+    return np.count_nonzero(x) / G.n_nodes
+
+
+@memoize
+def simulated_j_percolation_batch(G: CSRGraph,
+                                  infected_nodes: np.ndarray,
+                                  taus: np.ndarray,
+                                  Js: np.ndarray,
+                                  T: int,
+                                  rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Simulated J percolation of many (tau, J) replicas at the same time, see simulated_j_percolation_csr
 
+    The states are a matrix with a column for each replica, so every sweep traverses the graph once
+    with an integer sparse matrix-matrix product for the whole batch. p(s, k) is looked up in a table
+    with a row for each (k, s) pair of the degrees in the graph and a column for each replica,
+    and the replicas with no infected nodes are dropped from the batch.
 
-def simulated_approx_j_percolation(G: nx.Graph, tau: float, J: float, T: int) -> float:
+    :param G: CSR graph
+    :param infected_nodes: boolean array of the initially infected nodes, shared by all the replicas
+    :param taus: bare infection probability of each replica
+    :param Js: risk perception of each replica
+    :param T: number of iterations
+    :param rng: random generator
+    :return: the percentage of infected nodes of each replica
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    taus = np.asarray(taus, dtype=float)
+    Js = np.asarray(Js, dtype=float)
+
+    # Row offsets[d] + s of the table is p(s, k) of the d-th distinct degree k
+    degrees, node_degree = np.unique(G.degree, return_inverse=True)
+    sizes = degrees + 1
+    offsets = np.cumsum(sizes) - sizes
+    k = np.repeat(degrees, sizes)[:, np.newaxis]
+    s = (np.arange(len(k)) - np.repeat(offsets, sizes))[:, np.newaxis]
+    table = prob_being_infected_array(s, k, taus[np.newaxis, :], Js[np.newaxis, :])
+    rows = offsets[node_degree][:, np.newaxis]
+
+    A = adjacency_matrix(G, dtype=np.int32)
+    x = np.repeat(np.asarray(infected_nodes, dtype=bool)[:, np.newaxis], len(taus), axis=1)
+    alive = np.arange(len(taus))
+    infected = np.zeros(len(taus))
+    for _ in range(T):
+        s = A @ x  # quenched version
+        x = rng.random(x.shape) < np.take_along_axis(table, rows + s, axis=0)
+        spreading = x.any(axis=0)
+        if not spreading.all():
+            x, table, alive = x[:, spreading], table[:, spreading], alive[spreading]
+        if not alive.size:
+            break
+    infected[alive] = np.count_nonzero(x, axis=0) / G.n_nodes
+    return infected
+
+
+def simulated_approx_j_percolation(G: nx.Graph, tau: float, J: float, T: int, rng: np.random.Generator = None) -> float:
     """
     Simulated J percolation with approximation of the formula for the probability of being infected:
     {t * exp(-J * s / k)} = u(s, k)
@@ -47,24 +158,43 @@ def simulated_approx_j_percolation(G: nx.Graph, tau: float, J: float, T: int) ->
     :param tau: bare infection probability
     :param J: risk perception
     :param T: number of iterations
+    :param rng: random generator, passed to the CSR kernel
+    :return: return the percentage of infected nodes
+    """
+    return simulated_approx_j_percolation_csr(to_csr(G), get_infected_mask(G), tau, J, T, rng)
+
+
+def simulated_approx_j_percolation_csr(G: CSRGraph,
+                                       infected_nodes: np.ndarray,
+                                       tau: float,
+                                       J: float,
+                                       T: int,
+                                       rng: np.random.Generator = None) -> float:
+    """
+    Simulated approximated J percolation on the CSR graph, see simulated_approx_j_percolation
+    The graph is only read and the states are a new array, so the same graph is shared by all the trials.
+
+    :param G: CSR graph
+    :param infected_nodes: boolean array of the initially infected nodes
+    :param tau: bare infection probability
+    :param J: risk perception
+    :param T: number of iterations
+    :param rng: random generator
     :return: return the percentage of infected nodes
     """
+    rng = np.random.default_rng() if rng is None else rng
+    node_states = NodeStates(G, np.where(infected_nodes, infected_code, healthy_code))
     for _ in range(T):
-        prev_states = {node: G.nodes[node][state] for node in G.nodes}
-        for node in G.nodes:
-            k = G.degree(node)
-            # TODO: implementation the annealed version
-            s = get_infected_neighbors(G, node, prev_states)  # quenched version
-            r = random.random()
-            G.nodes[node][state] = infected if r < s * infected_prob(s, k, tau, J) else healthy
-    return get_percentage_infected(G)
+        # quenched version
+        node_states.set_infected(rng.random(G.n_nodes) < node_states.risk(J, tau, approx=True))
+    return node_states.infected_count() / G.n_nodes
 
 
 # ______________________________________________________________________________________________________________________
 # Simple Percolation Tests (Direct Percolation)
 
 
-def simulated_simple_percolation(G: nx.graph, T: int, tau: float) -> float:
+def simulated_simple_percolation(G: nx.graph, T: int, tau: float, rng: np.random.Generator = None) -> float:
     """
     Simulated simple percolation:
     TODO add formula for simple percolation
@@ -73,19 +203,59 @@ def simulated_simple_percolation(G: nx.graph, T: int, tau: float) -> float:
     :param G: graph
     :param T: number of iterations
     :param tau: infection probability
+    :param rng: random generator, passed to the CSR kernel
+    :return: return the percentage of infected nodes
+    """
+    return simulated_simple_percolation_csr(to_csr(G), get_infected_mask(G), T, tau, rng)
+
+
+@memoize
+def simulated_simple_percolation_csr(G: CSRGraph,
+                                     infected_nodes: np.ndarray,
+                                     T: int,
+                                     tau: float,
+                                     rng: np.random.Generator = None,
+                                     monitor: ConvergenceMonitor = None,
+                                     block_size: int = None,
+                                     backend: str = backend) -> float:
+    """
+    Simulated simple percolation on the CSR graph, see simulated_simple_percolation
+    A node is infected if at least one infected neighbor transmits the infection with probability tau.
+    The iterations stop early when the monitor detects no infected nodes or a stationary percentage.
+    With a block size the edges are read one block of nodes at a time, see node_blocks.
+    With the numba backend each sweep is a compiled loop over the edges, with the same random numbers.
+
+    :param G: CSR graph
+    :param infected_nodes: boolean array of the initially infected nodes
+    :param T: number of iterations
+    :param tau: infection probability
+    :param rng: random generator
+    :param monitor: convergence monitor of the percentage of infected nodes
+    :param block_size: number of nodes of each block, the whole graph at once if None
+    :param backend: "numba" to run the sweeps compiled if numba is installed, otherwise "numpy"
     :return: return the percentage of infected nodes
     """
-    states = {node: G.nodes[node][state] for node in G.nodes}
+    rng = np.random.default_rng() if rng is None else rng
+    monitor = ConvergenceMonitor() if monitor is None else monitor
+    x = np.array(infected_nodes, dtype=bool)
 
     for _ in range(T):
-        c_state = states.copy()
-        for node in G.nodes:
-            caution = any(tau > random.random() and c_state[n] == infected for n in G.neighbors(node))
-            states[node] = infected if caution else healthy
-    return get_percentage_infected(G, states)
-
-
-def tau_simple_percolation(G: nx.Graph, iterations: int) -> float:
+        cx = x
+        x = np.zeros(G.n_nodes, dtype=bool)
+        for start, stop, block in node_blocks(G, block_size):
+            r = rng.random(len(block.indices))
+            if use_jit(backend):
+                x[start:stop] = simple_percolation_sweep(block.indptr, block.indices, cx, r, tau)
+                continue
+            # Edges from an infected neighbor that transmit the infection
+            caution = cx[block.indices] & (r < tau)
+            x[start + segment_rows(block)[caution]] = True
+        if monitor.update(np.count_nonzero(x) / G.n_nodes):
+            break
+    return np.count_nonzero(x) / G.n_nodes
+
+
+def tau_simple_percolation(G: nx.Graph, iterations: int, rng: np.random.Generator = None) -> float:
     """
     Update the values of tau parameters associated with the nodes in graph G based on simple percolation.
 
@@ -100,28 +270,76 @@ def tau_simple_percolation(G: nx.Graph, iterations: int) -> float:
 
     :param G: NetworkX graph
     :param iterations: Number of iterations
+    :param rng: Random generator, passed to the CSR kernel
     :return: Updated tau values for each node
     """
+    return tau_simple_percolation_csr(to_csr(G), iterations, rng)
+
+
+@memoize
+def tau_simple_percolation_csr(G: CSRGraph,
+                               iterations: int,
+                               rng: np.random.Generator = None,
+                               quenched: bool = False,
+                               tol: float = 0,
+                               monitor: ConvergenceMonitor = None,
+                               block_size: int = None,
+                               backend: str = backend) -> float:
+    """
+    Simple percolation on the CSR graph, see tau_simple_percolation
+
+    Each iteration is a segmented reduction over the edges: the random numbers of all the edges are drawn at once,
+    max(rij, tau[j]) is taken edge by edge and the minimum over the neighbors of each node with np.minimum.reduceat.
+    With quenched random numbers, drawn once for all the iterations, the min max has a fixed point that is reached
+    exactly and the iterations stop once no tau value changes by more than tol; with new random numbers at each
+    iteration the values keep fluctuating and the iterations stop when the monitor detects a stationary minimum tau,
+    unchanged for stall_window iterations.
+    With a block size the edges are read one block of nodes at a time, see node_blocks. The quenched random numbers
+    are one for each edge, so they can not be streamed.
+    With the numba backend each sweep is a compiled loop over the edges, with the same random numbers.
+
+    :param G: CSR graph
+    :param iterations: Number of iterations
+    :param rng: random generator
+    :param quenched: draw the random numbers of the edges once instead of at each iteration
+    :param tol: largest change of the tau values that stops the iterations with quenched random numbers
+    :param monitor: convergence monitor of the minimum tau value
+    :param block_size: number of nodes of each block, the whole graph at once if None
+    :param backend: "numba" to run the sweeps compiled if numba is installed, otherwise "numpy"
+    :return: Minimum of the tau values
+    """
+    if quenched and block_size is not None:
+        raise ValueError("The quenched random numbers of all the edges can not be streamed in blocks")
+    rng = np.random.default_rng() if rng is None else rng
+    # All the nodes start infected with tau = 0, so there is no absorbing state
+    monitor = ConvergenceMonitor(tol=0, window=stall_window, absorbing=None) if monitor is None else monitor
+
     # Initialize tau values for each node
-    tau = {node: 0.0 for node in G.nodes()}
+    tau = np.zeros(G.n_nodes)
 
-    for _ in range(iterations):
-        ct = tau.copy()
-        # Iterate over each node in the graph
-        for node in G.nodes():
-            # Calculate max values for all neighbors
-            # Update tau[node] using the minimum of max_values
+    r = rng.random(len(G.indices)) if quenched else None
 
-            # NOTFIXME: Check if necessary to append 1 to max_values before finding the min
-            tau[node] = np.min([1]+[max(random.random(), ct[j]) for j in G.neighbors(node)])
-    return min(tau.values())
+    for _ in range(iterations):
+        ct = tau
+        tau = np.empty(G.n_nodes)
+        for start, stop, block in node_blocks(G, block_size):
+            if not quenched:
+                r = rng.random(len(block.indices))
+            if use_jit(backend):
+                tau[start:stop] = tau_percolation_sweep(block.indptr, block.indices, ct, r)
+                continue
+            # The nodes without neighbors keep tau = 1
+            tau[start:stop] = segment_reduce(np.minimum, block, np.maximum(r, ct[block.indices]), 1)
+        if (quenched and np.abs(tau - ct).max() <= tol) or monitor.update(tau.min()):
+            break
+    return tau.min()
 
 # ______________________________________________________________________________________________________________________
 # Infection with risk percolation
 
 
 # FIXME Check if the function is working properly
-def critic_j_percolation(G: nx.Graph, tau: float, T: int) -> float:
+def critic_j_percolation(G: nx.Graph, tau: float, T: int, rng: np.random.Generator = None) -> float:
     """
     Calculate the critical J values for percolation.
 
@@ -136,29 +354,73 @@ def critic_j_percolation(G: nx.Graph, tau: float, T: int) -> float:
     :param G: NetworkX graph
     :param tau: Infection probability
     :param T: Number of iterations
+    :param rng: Random generator, passed to the CSR kernel
     :return: Updated critical J values
     """
+    return critic_j_percolation_csr(to_csr(G), tau, T, rng=rng)
+
+
+@memoize
+def critic_j_percolation_csr(G: CSRGraph,
+                             tau: float,
+                             T: int,
+                             rng: np.random.Generator = None,
+                             j0: float = max_j,
+                             monitor: ConvergenceMonitor = None,
+                             block_size: int = None,
+                             backend: str = backend) -> float:
+    """
+    Critical J percolation on the CSR graph, see critic_j_percolation
+
+    Each sweep works on all the edges at once: s[Jj] is the number of neighbors of i with J >= Jj, computed by
+    sorting the J values of the neighbors of each node once and counting with a binary search, O(k log k) per node
+    instead of O(k^2). The max min over the neighbors is a segmented reduction.
+    The sweeps stop early when the monitor detects that the maximum J is zero or has stalled.
+    With a block size the edges are read one block of nodes at a time, see node_blocks.
+    With the numba backend each sweep is a compiled loop over the nodes, see critical_j_sweep.
+
+    :param G: CSR graph
+    :param tau: Infection probability
+    :param T: Number of iterations
+    :param rng: random generator
+    :param j0: initial J value of the nodes
+    :param monitor: convergence monitor of the maximum J value
+    :param block_size: number of nodes of each block, the whole graph at once if None
+    :param backend: "numba" to run the sweeps compiled if numba is installed, otherwise "numpy"
+    :return: Maximum of the critical J values
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    monitor = ConvergenceMonitor(tol=0, window=stall_window) if monitor is None else monitor
 
     # Initialize J values for each node
-    # j_values = {node: float('inf') for node in G.nodes()}
-    j_values = {node: max_j for node in G.nodes()}
+    j_values = np.full(G.n_nodes, float(j0))
 
     for _ in range(T):
-        cj = j_values.copy()
-        for node in G.nodes():
-            k = G.degree(node)
-            s = np.array([sum(cj[n] >= cj[j] for n in G.neighbors(node)) for j in G.neighbors(node)])
-            jp = np.array([risk_perception(k, si, np.random.random(), tau) for si in s])
-            cjs = np.array([cj[j] for j in G.neighbors(node)])
-            j_values[node] = max(np.append(0, np.minimum(cjs, jp)))
-    return max(j_values.values())
+        cj = j_values
+        ranks = None if use_jit(backend) else np.unique(cj, return_inverse=True)[1]
+        j_values = np.empty(G.n_nodes)
+        for start, stop, block in node_blocks(G, block_size):
+            r = rng.random(len(block.indices))
+            if use_jit(backend):
+                j_values[start:stop] = critical_j_sweep(block.indptr, block.indices, block.indptr, block.indices,
+                                                        cj, r, tau)
+                continue
+            rows = segment_rows(block)
+            cjs = cj[block.indices]
+            # s[j] counts the neighbors n with cj[n] >= cj[j]
+            s = count_greater_equal(block, cj, rows, block.indices, ranks)
+            jp = risk_perception_array(block.degree[rows], s, r, tau)
+            j_values[start:stop] = np.maximum(segment_reduce(np.maximum, block, np.minimum(cjs, jp), 0), 0)
+        if monitor.update(j_values.max()):
+            break
+    return j_values.max()
 
 
 # ______________________________________________________________________________________________________________________
 # The self-organized percolation method for multiplex networks
 
 # FIXME Check if the function is working properly
-def multiplex_percolation(IG: nx.DiGraph, PG: nx.graph, tau: float, T: int) -> float:
+def multiplex_percolation(IG: nx.DiGraph, PG: nx.graph, tau: float, T: int, rng: np.random.Generator = None) -> float:
     """
     Multiplex percolation model
 
@@ -166,19 +428,67 @@ def multiplex_percolation(IG: nx.DiGraph, PG: nx.graph, tau: float, T: int) -> f
     :param PG: Physical graph
     :param tau: Infection probability
     :param T: Number of iterations
+    :param rng: Random generator, passed to the CSR kernel
     :return: Updated critical J values
     """
 
+    return multiplex_percolation_csr(to_csr(IG, nodes=PG.nodes()), to_csr(PG), tau, T, rng=rng)
+
+
+@memoize
+def multiplex_percolation_csr(IG: CSRGraph,
+                              PG: CSRGraph,
+                              tau: float,
+                              T: int,
+                              rng: np.random.Generator = None,
+                              j0: float = max_j,
+                              monitor: ConvergenceMonitor = None,
+                              block_size: int = None,
+                              backend: str = backend) -> float:
+    """
+    Multiplex percolation model on the CSR graphs, see multiplex_percolation
+    The two graphs share the same node index.
+
+    Each sweep works on all the edges of PG at once: for the edge (i, j) s is the number of neighbors of i in IG
+    with J >= Jj, counted with a binary search in the J values of the IG neighbors sorted once per sweep.
+    The max min over the PG neighbors is a segmented reduction.
+    The sweeps stop early when the monitor detects that the maximum J is zero or has stalled.
+    With a block size the edges of both graphs are read one block of nodes at a time, see node_blocks.
+    With the numba backend each sweep is a compiled loop over the nodes, see critical_j_sweep.
+
+    :param IG: Information graph
+    :param PG: Physical graph
+    :param tau: Infection probability
+    :param T: Number of iterations
+    :param rng: random generator
+    :param j0: initial J value of the nodes
+    :param monitor: convergence monitor of the maximum J value
+    :param block_size: number of nodes of each block, the whole graphs at once if None
+    :param backend: "numba" to run the sweeps compiled if numba is installed, otherwise "numpy"
+    :return: Maximum of the critical J values
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    monitor = ConvergenceMonitor(tol=0, window=stall_window) if monitor is None else monitor
+
     # Initialize J values for each node
-    # j_values = {node: float('inf') for node in PG.nodes()}
-    j_values = {node: max_j for node in PG.nodes()}
+    j_values = np.full(PG.n_nodes, float(j0))
 
     for _ in range(T):
-        cj = j_values.copy()
-        for node in PG.nodes():
-            k = PG.degree(node)
-            s = np.array([sum(cj[n] >= cj[j] for n in IG.neighbors(node)) for j in PG.neighbors(node)])
-            jp = np.array([risk_perception(k, si, np.random.random(), tau) for si in s])
-            cjs = np.array([cj[j] for j in PG.neighbors(node)])
-            j_values[node] = max(np.append(0, np.minimum(cjs, jp)))
-    return max(j_values.values())
+        cj = j_values
+        ranks = None if use_jit(backend) else np.unique(cj, return_inverse=True)[1]
+        j_values = np.empty(PG.n_nodes)
+        for (start, stop, block), (_, _, info) in zip(node_blocks(PG, block_size), node_blocks(IG, block_size)):
+            r = rng.random(len(block.indices))
+            if use_jit(backend):
+                j_values[start:stop] = critical_j_sweep(block.indptr, block.indices, info.indptr, info.indices,
+                                                        cj, r, tau)
+                continue
+            rows = segment_rows(block)
+            cjs = cj[block.indices]
+            # s[j] counts the information neighbors z with cj[z] >= cj[j]
+            s = count_greater_equal(info, cj, rows, block.indices, ranks)
+            jp = risk_perception_array(block.degree[rows], s, r, tau)
+            j_values[start:stop] = np.maximum(segment_reduce(np.maximum, block, np.minimum(cjs, jp), 0), 0)
+        if monitor.update(j_values.max()):
+            break
+    return j_values.max()
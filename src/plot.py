@@ -68,6 +68,19 @@ def plot_update(G: nx.Graph, pos: dict) -> None:
 # Plotting for Critical J and Tau For mean field and percolation
 
 
+def plot_error_bars(results: dict, x: str, y: str, color: str) -> None:
+    """
+    Plot the standard error over the replicas of the values y, if the results have it
+
+    :param results: dict of results
+    :param x: key of the x values
+    :param y: key of the y values
+    :param color: color of the error bars
+    """
+    if y + err_suffix in results:
+        plt.errorbar(results[x], results[y], yerr=results[y + err_suffix], color=color, linestyle="", capsize=2)
+
+
 def plot_critical_j(results: dict, file: str, prediction: bool = True) -> None:
     """
     Plot the critical J values
@@ -83,6 +96,7 @@ def plot_critical_j(results: dict, file: str, prediction: bool = True) -> None:
         color = colors.pop(0)
         plt.plot(results[graph_type][t_test], results[graph_type][j_test],
                  label=graph_type, color=color, marker="", linestyle="--", linewidth=3)
+        plot_error_bars(results[graph_type], t_test, j_test, color)
         if prediction:
             plt.plot(results[graph_type][t_test], results[graph_type][j_pred],
                      label="Theory: " + graph_type, color=black, marker="", linestyle="--", linewidth=1)
@@ -113,9 +127,11 @@ def plot_percolation_critical_j(results: dict, file: str, prediction: bool = Tru
         color = colors.pop(0)
         plt.plot(results[graph_type][t_test], results[graph_type][j_test],
                  label=graph_type, color=color, marker=".", linestyle="--")
+        plot_error_bars(results[graph_type], t_test, j_test, color)
         if prediction:
             plt.plot(results[graph_type][t_test], results[graph_type][j_pred],
                      label="Theory: " + graph_type, color=black, marker="", linestyle="--")
+            plot_error_bars(results[graph_type], t_test, j_pred, black)
     plt.xlabel("τ")
     plt.ylabel("Jc")
     plt.legend()
@@ -142,6 +158,7 @@ def plot_critical_t(results: dict, file: str, prediction: bool = True) -> None:
         color = colors.pop(0)
         plt.plot(results[graph_type][t_test], results[graph_type][v_pred], label=graph_type, marker="", linestyle="-",
                  color=color)
+        plot_error_bars(results[graph_type], t_test, v_pred, color)
         if prediction:
             plt.plot(results[graph_type][t_pred][0], 0, label="Theory τc", marker="s", linestyle=" ", color=color)
     plt.xlabel("τ")
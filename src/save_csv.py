@@ -19,16 +19,21 @@ def save_results(results: dict, file: str, path: str = path_results) -> None:
 
 def load_results(results: dict, file: str, path: str = path_results) -> dict:
     """
-    Load the results from a csv file
+    Load the results from a csv file written by save_results, the first row is the header with the keys
 
-    :param results: dict of results
+    :param results: dict of results, the columns of the file are added to it
     :param file: file name
     :param path: path to save the file
+    :return: return the dict of results
     """
     with open(path + file, 'r') as file:
         reader = csv.reader(file)
+        header = next(reader)
+        columns = {key: [] for key in header}
         for row in reader:
-            results[row[0]] = row[1:]
+            for key, value in zip(header, row):
+                columns[key].append(float(value))
+    results.update(columns)
     return results
 
 
@@ -1,13 +1,24 @@
+from typing import Callable
+
 import networkx as nx
 import numpy as np
 
-from src.config import zero_threshold
-from src.infection import get_average_graph_degree, simulated_j_percolation, simulated_approx_j_percolation
-from src.plot import plot_critical_j
-from src.utils import infected, state, healthy, t_test, j_test, j_pred, not_approx_jc_plot, approx_plot_jc_plot
-
-
-def not_approx_critical_j_test(G: nx.Graph, T: int, ts: np.array, js: np.array):
+from src.config import zero_threshold, master_seed
+from src.critical import bisect_critical_j
+from src.csr import to_csr
+from src.graphs import get_information_graph
+from src.infection import get_average_graph_degree, get_infected_mask, get_infected_neighbors, infected_prob, \
+    get_infected
+from src.percolation import critic_j_percolation_csr, multiplex_percolation_csr, simulated_j_percolation_csr, \
+    simulated_approx_j_percolation_csr
+from src.plot import plot_critical_j, plot_percolation_critical_j
+from src.seeding import stream
+from src.tests import simulated_j_grid_test
+from src.utils import infected, state, healthy, t_test, j_test, j_pred, j_low, j_high, q_test, not_approx_jc_plot, \
+    approx_plot_jc_plot, percolation_jc_plot
+
+
+def not_approx_critical_j_test(G: nx.Graph, T: int, ts: np.array, js: np.array, seed: int = master_seed):
     """
     Get the critical J values test
 
@@ -15,30 +26,21 @@ def not_approx_critical_j_test(G: nx.Graph, T: int, ts: np.array, js: np.array):
     :param T: iteration
     :param ts: values of tau
     :param js: values of risk perception J
+    :param seed: master seed of the random streams of the simulations
     :return: return the critical J values
     """
 
-    # Calculate the average degree of the graph
-    k = get_average_graph_degree(G)
+    # Simulate the whole (tau, J) grid in batches of replicas
+    results = simulated_j_grid_test(G, T, ts, js, seed=seed)
+    plot_critical_j({"Simulation": results}, file=not_approx_jc_plot+".png")
 
-    results = {t_test: [], j_test: [], j_pred: []}
-    for t in reversed(ts):
-        # Calculate the critical J prediction from the mean field approximation
-        jc_pred = k * np.log(k * t)
-        print(f"Critical J prediction: {jc_pred}")
-        for j in js:
-            print(f"t: {round(t,2)}, j: {round(j,2)}")
-            v = simulated_j_percolation(G.copy(), t, j, T)
-            if v <= zero_threshold:
-                results[t_test].append(t)
-                results[j_test].append(j)
-                results[j_pred].append(jc_pred if jc_pred > 0 else 0)
-                break
-        print("--------------------------------------------------", end="\n\n")
-    plot_critical_j(results, file=not_approx_jc_plot)
 
-
-def approx_critical_j_test(G: nx.Graph, T: int, ts: np.array, js: np.array):
+def approx_critical_j_test(G: nx.Graph,
+                           T: int,
+                           ts: np.array,
+                           js: np.array,
+                           finder: Callable = bisect_critical_j,
+                           seed: int = master_seed):
     """
     Get the critical J values test
 
@@ -46,29 +48,41 @@ def approx_critical_j_test(G: nx.Graph, T: int, ts: np.array, js: np.array):
     :param T: iteration
     :param ts: values of tau
     :param js: values of risk perception J
+    :param finder: critical J search, bisect_critical_j or linear_critical_j
+    :param seed: master seed of the random streams of the simulations
     :return: return the critical J values
     """
 
     # Calculate the average degree of the graph
     k = get_average_graph_degree(G)
+    # The topology is converted once and every trial starts from the same initial states
+    csr, infected_nodes = to_csr(G), get_infected_mask(G)
 
-    results = {t_test: [], j_test: [], j_pred: []}
+    results = {t_test: [], j_test: [], j_pred: [], j_low: [], j_high: []}
     for t in reversed(ts):
         jc_pred = k * np.log(k * t)
         print(f"Critical J prediction: {jc_pred}")
-        for j in js:
-            print(f"t: {round(t,2)}, j: {round(j,2)}")
-            v = simulated_approx_j_percolation(G.copy(), t, j, T)
-            if v <= zero_threshold:
-                results[t_test].append(t)
-                results[j_test].append(j)
-                results[j_pred].append(jc_pred if jc_pred > 0 else 0)
-                break
+        critical = finder(lambda j: simulated_approx_j_percolation_csr(
+            csr, infected_nodes, t, j, T, stream((approx_critical_j_test, t, j), seed)), js)
+        if critical is not None:
+            jc, low, high = critical
+            print(f"t: {round(t,2)}, j: {round(jc,2)} in [{round(low,2)}, {round(high,2)}]")
+            results[t_test].append(t)
+            results[j_test].append(jc)
+            results[j_pred].append(jc_pred if jc_pred > 0 else 0)
+            results[j_low].append(low)
+            results[j_high].append(high)
         print("--------------------------------------------------", end="\n\n")
-    plot_critical_j(results, file=approx_plot_jc_plot)
+    plot_critical_j({"Approximation": results}, file=approx_plot_jc_plot+".png")
 
 
-def multiplex_percolation_critical_j_test(IG: nx.DiGraph, PG: nx.Graph, T: int, ts: np.array, js: np.array, qs: np.array):
+def multiplex_percolation_critical_j_test(IG: nx.DiGraph,
+                                          PG: nx.Graph,
+                                          T: int,
+                                          ts: np.array,
+                                          js: np.array,
+                                          qs: np.array,
+                                          seed: int = master_seed):
     """
     Get the critical J values test
 
@@ -78,18 +92,21 @@ def multiplex_percolation_critical_j_test(IG: nx.DiGraph, PG: nx.Graph, T: int,
     :param ts: values of tau
     :param js: values of risk perception J
     :param qs: values of q
+    :param seed: master seed of the random streams of the simulations
     :return: return the critical J values
     """
+    pg, infected_nodes = to_csr(PG), get_infected_mask(PG)
     results = {q_test: [], t_test: [], j_test: [], j_pred: []}
     for q in qs:
         for t in reversed(ts):
             # Calculate the jc prediction about percolation
-            jc_pred = multiplex_percolation(IG, PG, t, T)
+            jc_pred = multiplex_percolation(IG, PG, t, T, stream((multiplex_percolation_critical_j_test, q, t), seed))
             print(f"Critical J prediction: {jc_pred}")
             for j in js:
                 print(f"t: {round(t,2)}, j: {round(j,2)}")
                 # Simulate the infection with the percolation scenario
-                v = simulated_j_percolation(PG.copy(), t, j, T)
+                v = simulated_j_percolation_csr(pg, infected_nodes, t, j, T,
+                                                stream((multiplex_percolation_critical_j_test, q, t, j), seed))
                 if v <= zero_threshold:
                     results[q_test].append(q)
                     results[t_test].append(t)
@@ -104,7 +121,8 @@ def simulated_multiplex(PG: nx.Graph,
                         q: float,
                         tau: float,
                         J: float,
-                        T: int) -> float:
+                        T: int,
+                        rng: np.random.Generator = None) -> float:
     """
     Simulated J percolation
 
@@ -114,21 +132,20 @@ def simulated_multiplex(PG: nx.Graph,
     :param tau: bare infection probability
     :param J: risk perception
     :param T: number of iterations
+    :param rng: random generator of the information graph and of the infections
     :return: return the percentage of infected nodes
     """
-    IG = get_information_graph(PG, VG, q)
+    rng = np.random.default_rng() if rng is None else rng
+    IG = get_information_graph(PG, VG, q, rng)
     for _ in range(T):
-        cIG = IG.copy
+        # States at the start of the sweep, the infected neighbors are counted in the information graph
+        states = dict(PG.nodes(data=state))
         for node in PG.nodes:
             k = PG.degree(node)
-            s = get_infected_neighbors(cIG, node)  # quenched version @TODO: implementation of the annealed version
-            r = np.random.uniform(0, 1)
+            s = get_infected_neighbors(IG, node, states)  # quenched version @TODO: annealed version
+            r = rng.random()
             psk = 1 - pow(1-infected_prob(s, k, tau, J), s)
-            if r < psk:
-                PG.nodes[node][state] = infected
-                IG.nodes[node][state] = infected
-            else:
-                PG.nodes[node][state], IG.nodes[node][state] = healthy
+            PG.nodes[node][state] = infected if r < psk else healthy
     return get_infected(PG) / PG.number_of_nodes()
 
 
@@ -137,7 +154,7 @@ def critical_j_test():
     critical_j_test(PG, ts, js, rec_prob=rec_prob, immunity=immunity, plot=False)
 
 
-def critic_j_percolation(G: nx.Graph, tau: float, T: int) -> float:
+def critic_j_percolation(G: nx.Graph, tau: float, T: int, rng: np.random.Generator = None) -> float:
     """
     Calculate the critical J values for percolation.
 
@@ -152,31 +169,16 @@ def critic_j_percolation(G: nx.Graph, tau: float, T: int) -> float:
     :param G: NetworkX graph
     :param tau: Infection probability
     :param T: Number of iterations
+    :param rng: Random generator
     :return: Updated critical J values
     """
 
     # Initialize J values for each node
     # TODO evaluation the initialization of J values
-    j_values = {node: float('inf') for node in G.nodes()}
+    return critic_j_percolation_csr(to_csr(G), tau, T, rng=rng, j0=float('inf'))
 
-    for _ in range(T):
-        cj = j_values.copy()
-        for node in G.nodes():
-            m = []
-            k = G.degree(node)
-            for j in G.neighbors(node):
-                # Calculate sum term
-                s = sum(cj[n] >= cj[j] for n in G.neighbors(node))
-                r = random.random()
-                # Calculate min max term
-                jp = risk_perception(k, s, r, tau)
-                m.append(min(cj[j], jp))
-            # Update J with the maximum value calculated
-            j_values[node] = max(m+[0])
-    return max(j_values.values())
-
-
-def multiplex_percolation(IG: nx.DiGraph, PG: nx.graph, tau: float, T: int) -> float:
+
+def multiplex_percolation(IG: nx.DiGraph, PG: nx.graph, tau: float, T: int, rng: np.random.Generator = None) -> float:
     """
     Multiplex percolation model
 
@@ -184,32 +186,19 @@ def multiplex_percolation(IG: nx.DiGraph, PG: nx.graph, tau: float, T: int) -> f
     :param PG: Physical graph
     :param tau: Infection probability
     :param T: Number of iterations
+    :param rng: Random generator
     :return: Updated critical J values
     """
 
     # Initialize J values for each node
-    j_values = {node: float('inf') for node in PG.nodes()}
-
-    for _ in range(T):
-        cj = j_values.copy()
-        for node in PG.nodes():
-            m = [0]
-            k = PG.degree(node)  # Calculate the degree of node i
-            for j in PG.neighbors(node):  # Iterate over neighbors of node i in PG
-                # Count neighbors with J greater than J[j]
-                si = sum(cj[z] >= cj[j] for z in IG.neighbors(node))
-                # Calculate min max term
-                r = random.random()
-                jp = risk_perception(k, si, r, tau)
-                m.append(min(cj[j], jp))
-            j_values[node] = max(m)  # Update J[i] with the maximum value calculated
-    return max(j_values.values())
+    return multiplex_percolation_csr(to_csr(IG, nodes=PG.nodes()), to_csr(PG), tau, T, rng=rng, j0=float('inf'))
 
 
 def percolation_jc_test(G: nx.Graph,
                         T: int,
                         ts: np.array,
-                        js: np.array) -> None:
+                        js: np.array,
+                        seed: int = master_seed) -> None:
     """
     Get the critical J values test
 
@@ -217,68 +206,77 @@ def percolation_jc_test(G: nx.Graph,
     :param T: iteration
     :param ts: values of tau
     :param js: values of risk perception J
+    :param seed: master seed of the random streams of the simulations
     :return: return the critical J values
     """
-
+    csr, infected_nodes = to_csr(G), get_infected_mask(G)
     results = {t_test: [], j_test: [], j_pred: []}
     for t in reversed(ts):
         # Calculate the jc prediction about percolation
-        jc_pred = critic_j_percolation(G, t, T)
+        jc_pred = critic_j_percolation(G, t, T, stream((percolation_jc_test, t), seed))
         print(f"Percolation-Critical J prediction: {jc_pred}")
         for j in js:
             print(f"t: {round(t, 2)}, j: {round(j, 2)}")
             # Simulate the infection with the percolation scenario
-            v = simulated_j_percolation(G, t, j, T)
+            v = simulated_j_percolation_csr(csr, infected_nodes, t, j, T, stream((percolation_jc_test, t, j), seed))
             if v <= zero_threshold:
                 results[t_test].append(t)
                 results[j_test].append(j)
                 results[j_pred].append(jc_pred)
                 break
         print("--------------------------------------------------", end="\n\n")
-    plot_critical_j2(results, file=approx_plot_jc_plot)
+    plot_percolation_critical_j({"Simulation": results}, file=percolation_jc_plot+".png")
 
 
 def percolation_jc_test_2(G: nx.Graph,
                           T: int,
-                          ts: np.array) -> dict:
+                          ts: np.array,
+                          finder: Callable = bisect_critical_j,
+                          seed: int = master_seed) -> dict:
     """
     Get the critical J values test
 
     :param G: graph
     :param T: iteration
     :param ts: values of tau
+    :param finder: critical J search, bisect_critical_j or linear_critical_j
+    :param seed: master seed of the random streams of the simulations
     :return: return results of the test
     """
-
-    results = {t_test: [], j_test: [], j_pred: []}
+    csr, infected_nodes = to_csr(G), get_infected_mask(G)
+    results = {t_test: [], j_test: [], j_pred: [], j_low: [], j_high: []}
     for t in reversed(ts):
         # Calculate the jc prediction about percolation
-        jc_pred = critic_j_percolation(G, t, T)
+        jc_pred = critic_j_percolation(G, t, T, stream((percolation_jc_test_2, t), seed))
         print(f"Percolation-Critical J prediction: {round(jc_pred, 2)}")
         # print(f"t: {round(t,2)}, j: {round(jc_pred,2)}")
         js = np.arange(0, 200, 0.1)
-        for j in js:
-            print(f"t: {round(t, 2)}, j: {round(j, 2)}")
-            # Simulate the infection with the percolation scenario
-            v = simulated_j_percolation(G, t, j, T)
-            if v <= zero_threshold:
-                results[t_test].append(t)
-                results[j_test].append(j)
-                results[j_pred].append(jc_pred)
-                break
+        # Simulate the infection with the percolation scenario
+        critical = finder(lambda j: simulated_j_percolation_csr(csr, infected_nodes, t, j, T,
+                                                                stream((percolation_jc_test_2, t, j), seed)), js)
+        if critical is not None:
+            jc, low, high = critical
+            print(f"t: {round(t, 2)}, j: {round(jc, 2)} in [{round(low, 2)}, {round(high, 2)}]")
+            results[t_test].append(t)
+            results[j_test].append(jc)
+            results[j_pred].append(jc_pred)
+            results[j_low].append(low)
+            results[j_high].append(high)
     print("--------------------------------------------------", end="\n\n")
     return results
 
 
 def percolation_jc_test_3(G: nx.Graph,
                           T: int,
-                          ts: np.array) -> dict:
+                          ts: np.array,
+                          seed: int = master_seed) -> dict:
     """
     Get the critical J values test
 
     :param G: graph
     :param T: iteration
     :param ts: values of tau
+    :param seed: master seed of the random streams of the simulations
     :return: return results of the test
     """
 
@@ -286,7 +284,7 @@ def percolation_jc_test_3(G: nx.Graph,
     print(f"Percolation-Critical J prediction: ", end="")
     for t in reversed(ts):
         # Calculate the jc prediction about percolation
-        jc_pred = critic_j_percolation(G, t, T)
+        jc_pred = critic_j_percolation(G, t, T, stream((percolation_jc_test_3, t), seed))
         print(f"t: {round(t, 2)}, j: {round(jc_pred, 2)}")
         results[t_test].append(t)
         results[j_test].append(jc_pred)
@@ -0,0 +1,70 @@
+import hashlib
+from functools import partial
+
+import numpy as np
+
+from src.config import master_seed
+
+
+def canonical_key(key) -> str:
+    """
+    Write the key of a random stream as a string that only depends on its values
+    Numbers are written as Python numbers, so np.float64(0.5) and 0.5 are the same key, arrays by their content
+    and functions by their qualified name, with their arguments for a partial.
+
+    :param key: tuple of numbers, strings, arrays, functions, partials or nested tuples
+    :return: return the canonical string of the key
+    """
+    if isinstance(key, (tuple, list)):
+        return "(" + ",".join(canonical_key(value) for value in key) + ")"
+    if isinstance(key, dict):
+        return "{" + ",".join(canonical_key(item) for item in sorted(key.items(), key=repr)) + "}"
+    if isinstance(key, np.ndarray):
+        digest = hashlib.blake2b(np.ascontiguousarray(key).tobytes(), digest_size=16).hexdigest()
+        return "array(" + key.dtype.str + "," + str(key.shape) + "," + digest + ")"
+    if isinstance(key, partial):
+        return canonical_key((key.func, key.args, key.keywords))
+    if isinstance(key, (bool, np.bool_)):
+        return repr(bool(key))
+    if isinstance(key, (int, np.integer)):
+        return repr(int(key))
+    if isinstance(key, (float, np.floating)):
+        return repr(float(key))
+    if callable(key):
+        return key.__module__ + "." + key.__qualname__
+    return repr(key)
+
+
+def stream_seed(key, seed: int = master_seed) -> np.random.SeedSequence:
+    """
+    Get the seed sequence of the random stream of a key, derived from the master seed
+    The key is hashed in the spawn key of the sequence, so every key has an independent stream that does not depend
+    on the order or on the process the jobs run in.
+
+    :param key: key of the stream, for example (graph, q, tau, J, replica)
+    :param seed: master seed
+    :return: return the seed sequence of the stream
+    """
+    digest = hashlib.blake2b(canonical_key(key).encode(), digest_size=16).digest()
+    return np.random.SeedSequence(seed, spawn_key=tuple(np.frombuffer(digest, dtype=np.uint32).tolist()))
+
+
+def generator(seed_sequence: np.random.SeedSequence) -> np.random.Generator:
+    """
+    Create the random generator of a seed sequence, with the counter based Philox bit generator
+
+    :param seed_sequence: seed sequence of the stream
+    :return: return the random generator
+    """
+    return np.random.Generator(np.random.Philox(seed_sequence))
+
+
+def stream(key, seed: int = master_seed) -> np.random.Generator:
+    """
+    Get the random generator of the stream of a key, see stream_seed
+
+    :param key: key of the stream
+    :param seed: master seed
+    :return: return the random generator
+    """
+    return generator(stream_seed(key, seed))
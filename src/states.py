@@ -0,0 +1,107 @@
+import numpy as np
+
+from src.csr import CSRGraph, adjacency_matrix, gather_neighbors, neighbor_count
+from src.infection import prob_being_infected_lookup
+from src.utils import healthy_code, infected_code
+
+
+class NodeStates:
+    """
+    States of the nodes of a CSR graph, as uint8 codes, with the number of infected neighbors of every node
+    The counts are kept up to date when the states change, adding or removing one for the neighbors of the nodes
+    that become infected or stop being infected, so a sweep where few nodes change costs the degrees of those
+    nodes instead of all the edges. When the changed nodes have more edges than recount_share of the graph,
+    the counts are computed again from scratch.
+    """
+
+    recount_share = 0.1
+
+    def __init__(self, G: CSRGraph, states: np.ndarray, block_size: int = None):
+        """
+        :param G: CSR graph, only read
+        :param states: initial states of the nodes, copied
+        :param block_size: number of nodes of each block when the counts are computed from scratch, see node_blocks
+        """
+        self.G = G
+        self.block_size = block_size
+        # The counts from scratch are a sparse matrix-vector product, unless the graph is streamed in blocks
+        self.A = adjacency_matrix(G, dtype=np.int64) if block_size is None else None
+        self.states = np.array(states, dtype=np.uint8)
+        self.s = self.count_infected_neighbors()
+
+    def count_infected_neighbors(self) -> np.ndarray:
+        """
+        Count the infected neighbors of every node from scratch
+
+        :return: return the number of infected neighbors of each node
+        """
+        x = self.states == infected_code
+        return self.A @ x if self.A is not None else neighbor_count(self.G, x, self.block_size)
+
+    def infected(self) -> np.ndarray:
+        """
+        :return: return True for the infected nodes
+        """
+        return self.states == infected_code
+
+    def infected_count(self) -> int:
+        """
+        :return: return the number of infected nodes
+        """
+        return np.count_nonzero(self.states == infected_code)
+
+    def risk(self, J: float, t: float, approx: bool = False) -> np.ndarray:
+        """
+        Compute the probability of being infected p(s, k) of every node from the lookup table, see update_risk
+
+        :param J: perception risk
+        :param t: bare infection probability
+        :param approx: the approximation s * u(s, k) instead of p(s, k)
+        :return: return the probability of being infected of each node
+        """
+        return prob_being_infected_lookup(self.s, self.G.degree, t, J, approx)
+
+    def set_states(self, nodes: np.ndarray, code: int) -> None:
+        """
+        Set the state of the nodes, updating the counts of the neighbors of the nodes whose infection changes
+
+        :param nodes: nodes whose state changes
+        :param code: code of the new state
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        was_infected = self.states[nodes] == infected_code
+        self.states[nodes] = code
+        changed = nodes[was_infected] if code != infected_code else nodes[~was_infected]
+        self.update_counts(changed, 1 if code == infected_code else -1)
+
+    def set_infected(self, x: np.ndarray, other: int = healthy_code) -> None:
+        """
+        Set the infected nodes of a synchronous sweep, the nodes no longer infected take the state other
+
+        :param x: True for the nodes infected after the sweep
+        :param other: code of the state of the nodes that are not infected
+        """
+        infected = self.states == infected_code
+        gained, lost = np.flatnonzero(x & ~infected), np.flatnonzero(infected & ~x)
+        self.states[gained] = infected_code
+        self.states[lost] = other
+        if self.G.degree[gained].sum() + self.G.degree[lost].sum() > self.recount_share * len(self.G.indices):
+            self.s = self.count_infected_neighbors()
+            return
+        self.update_counts(gained, 1)
+        self.update_counts(lost, -1)
+
+    def update_counts(self, nodes: np.ndarray, change: int) -> None:
+        """
+        Add change to the number of infected neighbors of the neighbors of the nodes
+
+        :param nodes: nodes that became infected or stopped being infected
+        :param change: 1 for the nodes that became infected, -1 for the others
+        """
+        if len(nodes) == 0:
+            return
+        if self.G.degree[nodes].sum() > self.recount_share * len(self.G.indices):
+            self.s = self.count_infected_neighbors()
+            return
+        neighbors, counts = np.unique(gather_neighbors(self.G, nodes), return_counts=True)
+        self.s[neighbors] += change * counts
@@ -0,0 +1,212 @@
+import csv
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+from src.journal import to_json
+from src.utils import path_results, path_stores
+
+# Metadata of a store: the dtype of each column, the number of rows and the metadata of the run
+metadata_file = "metadata.json"
+
+
+def read_metadata(path: str) -> dict:
+    """
+    Read the metadata of a store
+
+    :param path: directory of the store
+    :return: return the metadata of the store, with the columns, the rows and the metadata of the run
+    """
+    with open(os.path.join(path, metadata_file), "r") as file:
+        return json.load(file)
+
+
+def write_metadata(path: str, metadata: dict) -> None:
+    """
+    Write the metadata of a store in a temporary file renamed at the end, so the metadata is always complete
+
+    :param path: directory of the store
+    :param metadata: metadata of the store, see read_metadata
+    """
+    temporary = os.path.join(path, metadata_file + ".tmp-" + str(os.getpid()))
+    with open(temporary, "w") as file:
+        json.dump(metadata, file, default=to_json, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, os.path.join(path, metadata_file))
+
+
+def column_file(path: str, name: str) -> str:
+    """
+    :param path: directory of the store
+    :param name: name of the column
+    :return: return the file of the column, its values as raw binary data
+    """
+    return os.path.join(path, name + ".bin")
+
+
+def append_store(results: dict, path: str, metadata: dict = None) -> None:
+    """
+    Append the rows of a dict of results to a columnar store, creating it if needed
+    Each column is a raw binary file of a numeric dtype and the metadata holds the number of rows, written after
+    the values, so an interrupted append is dropped and overwritten by the next one.
+
+    :param results: dict of results, a list of values for each column
+    :param path: directory of the store
+    :param metadata: metadata of the run, like the number of nodes and of iterations, merged with the stored one
+    """
+    columns = {name: np.asarray(values) for name, values in results.items()}
+    if len({len(values) for values in columns.values()}) > 1:
+        raise ValueError("The columns of the results have different lengths")
+    for name, values in columns.items():
+        if values.dtype.kind not in "biuf":
+            raise ValueError(f"The column {name} is not numeric")
+
+    if os.path.isfile(os.path.join(path, metadata_file)):
+        store = read_metadata(path)
+        if set(store["columns"]) != set(columns):
+            raise ValueError(f"The columns {sorted(columns)} are not the columns of the store, "
+                             f"{sorted(store['columns'])}")
+    else:
+        os.makedirs(path, exist_ok=True)
+        store = {"columns": {name: values.dtype.str for name, values in columns.items()}, "rows": 0, "metadata": {}}
+
+    for name, dtype in store["columns"].items():
+        dtype = np.dtype(dtype)
+        with open(column_file(path, name), "ab") as file:
+            file.truncate(store["rows"] * dtype.itemsize)
+            file.write(columns[name].astype(dtype).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+    store["rows"] += len(next(iter(columns.values()), []))
+    store["metadata"].update(metadata or {})
+    write_metadata(path, store)
+
+
+def save_store(results: dict, path: str, metadata: dict = None) -> None:
+    """
+    Save a dict of results as a new columnar store, replacing the store in path if there is one, see append_store
+
+    :param results: dict of results, a list of values for each column
+    :param path: directory of the store
+    :param metadata: metadata of the run
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    append_store(results, path, metadata)
+
+
+def load_store(path: str, mmap: bool = True) -> dict:
+    """
+    Load the columns of a store
+
+    :param path: directory of the store
+    :param mmap: if True the columns are memory mapped read only instead of read in memory
+    :return: return the dict of results, an array for each column
+    """
+    store = read_metadata(path)
+    results = {}
+    for name, dtype in store["columns"].items():
+        dtype, rows = np.dtype(dtype), store["rows"]
+        if mmap and rows:
+            results[name] = np.memmap(column_file(path, name), dtype=dtype, mode="r", shape=(rows,))
+        else:
+            results[name] = np.fromfile(column_file(path, name), dtype=dtype, count=rows)
+    return results
+
+
+def find_stores(directory: str = path_stores, **metadata) -> list:
+    """
+    Find the stores in a directory whose run metadata has the given values, reading only their metadata
+
+    :param directory: directory searched, with its subdirectories
+    :param metadata: values of the metadata, like n_nodes=10000
+    :return: return the directories of the stores, sorted
+    """
+    paths = []
+    for root, _, files in os.walk(directory):
+        if metadata_file in files:
+            run = read_metadata(root)["metadata"]
+            if all(run.get(key) == value for key, value in metadata.items()):
+                paths.append(root)
+    return sorted(paths)
+
+
+def select_rows(results: dict, **values) -> dict:
+    """
+    Select the rows of a dict of results whose columns have the given values, float columns are compared with isclose
+
+    :param results: dict of results, an array for each column
+    :param values: values of the columns, like q_test=0.5
+    :return: return the selected rows, an array for each column
+    """
+    mask = np.ones(len(next(iter(results.values()), [])), dtype=bool)
+    for name, value in values.items():
+        column = np.asarray(results[name])
+        mask &= np.isclose(column, value) if column.dtype.kind == "f" else column == value
+    return {name: np.asarray(column)[mask] for name, column in results.items()}
+
+
+# ______________________________________________________________________________________________________________________
+# Results saved as CSV files
+
+
+def graph_label(family: str) -> str:
+    """
+    Get the graph type used in the results of the tests from the graph family of a file name,
+    like Scale Free <k>=6 from ScaleFree-k6 and Poisson <k>=6 and Scale Free <k>=6 from Poisson-k6+ScaleFree-k6
+
+    :param family: graph family in the name of the file
+    :return: return the graph type
+    """
+    labels = []
+    for graph in family.split("+"):
+        match = re.fullmatch(r"([A-Za-z]+)(?:-k(\d+))?", graph)
+        if match is None:
+            labels.append(graph)
+            continue
+        label = re.sub(r"(?<=[a-z])(?=[A-Z])", " ", match.group(1))
+        labels.append(label + (" <k>=" + match.group(2) if match.group(2) else ""))
+    return " and ".join(labels)
+
+
+def run_metadata(name: str) -> dict:
+    """
+    Get the metadata of a run from the name of its CSV file, like MUL/Poisson-k6_nodes10000_it100_jm100
+    or MF/k6-it10000 for the mean field, whose graph type is <k>=6 as in mean_field_test
+
+    :param name: name of the file, the directory of the test is optional
+    :return: return the test, the graph type, like Poisson <k>=6, and the k, n_nodes, iterations and max_j in the name
+    """
+    test = os.path.basename(os.path.dirname(name))
+    name = os.path.splitext(os.path.basename(name))[0]
+    metadata = {"test": test} if test else {}
+    patterns = {"k": r"(?:^|-)k(\d+)", "n_nodes": r"nodes(\d+)", "iterations": r"(?:^|[-_])in?t(\d+)",
+                "max_j": r"_jm(\d+|inf)"}
+    for key, pattern in patterns.items():
+        match = re.search(pattern, name)
+        if match:
+            metadata[key] = float(match.group(1)) if match.group(1) == "inf" else int(match.group(1))
+    if re.match(r"k\d+-", name):
+        metadata["graph_type"] = "<k>=" + str(metadata["k"])
+    else:
+        metadata["graph_type"] = graph_label(re.sub(r"-nodes\d+", "", name.split("_")[0]))
+    return metadata
+
+
+def import_csv(file: str, store: str, path: str = path_results, metadata: dict = None) -> None:
+    """
+    Convert a CSV file written by save_results to a columnar store, with the metadata found in its name
+
+    :param file: file name
+    :param store: directory of the store
+    :param path: path of the file
+    :param metadata: metadata of the run, added to the one found in the name
+    """
+    with open(path + file, "r") as data:
+        reader = csv.reader(data)
+        header = next(reader)
+        rows = np.array([[float(value) for value in row] for row in reader], dtype=float).reshape(-1, len(header))
+    save_store(dict(zip(header, rows.T)), store, {**run_metadata(file), **(metadata or {})})
@@ -1,25 +1,100 @@
+from functools import partial
+from typing import Callable
+
 import numpy as np
 import networkx as nx
 
-from src.config import zero_threshold
-from src.graphs import get_information_graph
-from src.infection import get_critical_j, get_average_graph_degree
+from src.config import zero_threshold, batch_size, n_workers, master_seed, replicas
+from src.critical import bisect_critical_j, bisect_deterministic_j
+from src.csr import CSRGraph, to_csr
+from src.ensemble import Ensemble, ensemble_jobs, ensemble_keys
+from src.graphs import information_graph_draws, get_information_graph_csr
+from src.infection import get_critical_j, get_average_graph_degree, get_infected_mask
 from src.mean_field import simulated_mean_field_infection
-from src.percolation import (tau_simple_percolation, simulated_simple_percolation, critic_j_percolation,
-                             multiplex_percolation)
+from src.parallel import run_sweep, merge_results
+from src.percolation import (tau_simple_percolation_csr, simulated_simple_percolation_csr, critic_j_percolation_csr,
+                             multiplex_percolation_csr, simulated_j_percolation_batch)
+from src.seeding import stream
 from src.utils import *
 
+# The tests are split in three functions:
+# *_jobs returns the independent jobs of the test, see run_sweep
+# *_results merges the results of the jobs in the dict of results
+# *_test runs the jobs on the process pool and returns the dict of results
+
 
 # ______________________________________________________________________________________________________________________
 # Mean Field Tests
 
 
+def mean_field_jc_point(k: int,
+                        c: float,
+                        T: int,
+                        t: float,
+                        js: np.array,
+                        finder: Callable = bisect_deterministic_j,
+                        rng: np.random.Generator = None) -> dict:
+    """
+    Get the critical J value of the mean field for one value of tau
+
+    :param k: average degree of the graph
+    :param c: initial percentage of infected nodes
+    :param T: iteration
+    :param t: value of tau
+    :param js: values of risk perception J
+    :param finder: critical J search, bisect_deterministic_j with one trial for each J or linear_critical_j
+    :param rng: random generator given to every job by run_job, unused since the mean field is deterministic
+    :return: return the results for tau, None if the infection never dies out
+    """
+    jc_pred = get_critical_j(k, t)
+    critical = finder(lambda j: simulated_mean_field_infection(k, t, c, T, j), js)
+    if critical is None:
+        print(f"t: {round(t, 2)}, MF-Critical J prediction: {round(jc_pred, 2)}, j: not found")
+        return None
+    jc, low, high = critical
+    print(f"t: {round(t, 2)}, MF-Critical J prediction: {round(jc_pred, 2)}, "
+          f"j: {round(jc, 2)} in [{round(low, 2)}, {round(high, 2)}]")
+    return {t_test: t, j_test: jc, j_pred: jc_pred, j_low: low, j_high: high}
+
+
+def mean_field_jc_jobs(k: int,
+                       c: float,
+                       T: int,
+                       ts: np.array,
+                       js: np.array,
+                       finder: Callable = bisect_deterministic_j) -> list:
+    """
+    Get the jobs of the mean field critical J test, one for each tau
+
+    :param k: average degree of the graph
+    :param c: initial percentage of infected nodes
+    :param T: iteration
+    :param ts: values of tau
+    :param js: values of risk perception J
+    :param finder: critical J search, bisect_deterministic_j or linear_critical_j
+    :return: return the jobs of the test
+    """
+    return [(mean_field_jc_point, (), (k, c, T, t, js, finder)) for t in reversed(ts)]
+
+
+def mean_field_jc_results(rows: list) -> dict:
+    """
+    Merge the results of the jobs of the mean field critical J test
+
+    :param rows: results of the jobs
+    :return: return the critical J values
+    """
+    return merge_results(rows, [t_test, j_test, j_pred, j_low, j_high])
+
+
 # TODO - Add the number of the infected nodes in the results
 def mean_field_jc_test(k: int,
                        c: float,
                        T: int,
                        ts: np.array,
-                       js: np.array) -> dict:
+                       js: np.array,
+                       finder: Callable = bisect_deterministic_j,
+                       workers: int = n_workers) -> dict:
     """
     Get the critical J values test
 
@@ -28,93 +103,321 @@ def mean_field_jc_test(k: int,
     :param T: iteration
     :param ts: values of tau
     :param js: values of risk perception J
+    :param finder: critical J search, bisect_deterministic_j or linear_critical_j
+    :param workers: number of worker processes
     :return: return the critical J values
     """
-
-    results = {t_test: [], j_test: [], j_pred: []}
-    for t in reversed(ts):
-        jc_pred = get_critical_j(k, t)
-        print(f"MF-Critical J prediction: {jc_pred}")
-        for j in js:
-            print(f"t: {round(t, 2)}, j: {round(j, 2)}, ", end="")
-            v = simulated_mean_field_infection(k, t, c, T, j)
-            print(f"c: {round(v, 2)}")
-            if v <= zero_threshold:
-                results[t_test].append(t)
-                results[j_test].append(j)
-                results[j_pred].append(jc_pred)
-                break
-        print("--------------------------------------------------", end="\n\n")
-    return results
+    return mean_field_jc_results(run_sweep(mean_field_jc_jobs(k, c, T, ts, js, finder), workers=workers))
 
 
 # ______________________________________________________________________________________________________________________
 # Simple Percolation Tests (Direct Percolation)
 
 
-def simple_tau_percolation_test(G: nx.Graph,
+def simple_tau_percolation_jobs(key,
+                                infected_nodes: np.ndarray,
                                 T: int,
-                                ts: np.array) -> dict:
+                                ts: np.array,
+                                replicas: int = replicas,
+                                graph: Callable = None) -> list:
     """
-    Get the value of tau_critical
-    :param G: graph
+    Get the jobs of the critical tau test, the prediction of tau_critical and one simulation for each tau
+    With replicas the prediction and the simulations are averaged over the replicas, see ensemble_jobs.
+
+    :param key: key of the graph in the sweep
+    :param infected_nodes: boolean array of the initially infected nodes
     :param T: iteration
     :param ts: values of tau
-    :return: return the critical tau values
+    :param replicas: number of replicas of each job
+    :param graph: generator of a new graph for each replica, see generate_graph, the graph of the key if None
+    :return: return the jobs of the test
     """
-    tc_pred = tau_simple_percolation(G, iterations=T)
+    return (ensemble_jobs([(tau_simple_percolation_csr, (key,), (T,))], replicas, [t_pred], graph) +
+            ensemble_jobs([(simulated_simple_percolation_csr, (key,), (infected_nodes, T, t)) for t in reversed(ts)],
+                          replicas, [v_pred], graph))
 
-    results = {t_test: [], v_pred: [], t_pred: []}
 
-    print(f"Percolation-Critical tau prediction: {tc_pred}")
-    for t in reversed(ts):
-        v = simulated_simple_percolation(G, T, tau=t)
-        print(f"t: {round(t, 2)} Value of c: {v}")
+def simple_tau_percolation_results(ts: np.array, values: list) -> dict:
+    """
+    Merge the results of the jobs of the critical tau test
+    The results stop at the first tau for which the mean value of c dies out.
+
+    :param ts: values of tau
+    :param values: results of the jobs, numbers or the rows of the ensemble jobs
+    :return: return the critical tau values, with their statistics over the replicas if there are replicas
+    """
+    prediction = values[0] if isinstance(values[0], dict) else {t_pred: values[0]}
+    rows = [value if isinstance(value, dict) else {v_pred: value} for value in values[1:]]
+    keys = [v_pred, t_pred] + ensemble_keys(rows, [v_pred]) + ensemble_keys([prediction], [t_pred])
+
+    results = {key: [] for key in [t_test] + keys}
+
+    print(f"Percolation-Critical tau prediction: {prediction[t_pred]}")
+    for t, row in zip(reversed(ts), rows):
+        row = {**prediction, **row}
+        print(f"t: {round(t, 2)} Value of c: {row[v_pred]}")
         results[t_test].append(t)
-        results[v_pred].append(v)
-        results[t_pred].append(tc_pred)
-        if v <= zero_threshold:
+        for key in keys:
+            results[key].append(row[key])
+        if row[v_pred] <= zero_threshold:
             break
     print("--------------------------------------------------", end="\n\n")
     return results
 
 
+def simple_tau_percolation_test(G: nx.Graph,
+                                T: int,
+                                ts: np.array,
+                                replicas: int = replicas,
+                                workers: int = n_workers) -> dict:
+    """
+    Get the value of tau_critical
+    :param G: graph
+    :param T: iteration
+    :param ts: values of tau
+    :param replicas: number of replicas of each point
+    :param workers: number of worker processes
+    :return: return the critical tau values
+    """
+    jobs = simple_tau_percolation_jobs(g_type, get_infected_mask(G), T, ts, replicas)
+    return simple_tau_percolation_results(ts, run_sweep(jobs, {g_type: to_csr(G)}, workers=workers))
+
+
 # ______________________________________________________________________________________________________________________
 # Infection with risk percolation
 
 
+def risk_percolation_j_point(G: CSRGraph,
+                             T: int,
+                             t: float,
+                             rng: np.random.Generator = None) -> dict:
+    """
+    Get the critical J value of the risk percolation for one value of tau
+
+    :param G: CSR graph
+    :param T: iteration
+    :param t: value of tau
+    :param rng: random generator
+    :return: return the results for tau
+    """
+    k = int(G.degree.sum() / G.n_nodes)
+    jc_pred = critic_j_percolation_csr(G, t, T, rng=rng)
+    j = get_critical_j(k, t)
+    print(f"t: {round(t, 2)}, j: {round(j, 2)}, jc: {round(jc_pred, 2)}")
+    return {t_test: t, j_test: j, j_pred: jc_pred}
+
+
+def risk_percolation_j_jobs(key, T: int, ts: np.array, replicas: int = replicas, graph: Callable = None) -> list:
+    """
+    Get the jobs of the risk percolation critical J test, one for each tau
+    With replicas the critical J is averaged over the replicas, see ensemble_jobs.
+
+    :param key: key of the graph in the sweep
+    :param T: iteration
+    :param ts: values of tau
+    :param replicas: number of replicas of each job
+    :param graph: generator of a new graph for each replica, see generate_graph, the graph of the key if None
+    :return: return the jobs of the test
+    """
+    jobs = [(risk_percolation_j_point, (key,), (T, t)) for t in reversed(ts)]
+    return ensemble_jobs(jobs, replicas, [j_test, j_pred], graph)
+
+
+def risk_percolation_j_results(rows: list) -> dict:
+    """
+    Merge the results of the jobs of the risk percolation critical J test
+
+    :param rows: results of the jobs
+    :return: return the critical J values, with their statistics over the replicas if there are replicas
+    """
+    return merge_results(rows, [t_test, j_test, j_pred] + ensemble_keys(rows, [j_test, j_pred]))
+
+
 def risk_percolation_j_test(G: nx.graph,
                             T: int,
-                            ts: np.array) -> dict:
+                            ts: np.array,
+                            replicas: int = replicas,
+                            workers: int = n_workers) -> dict:
     """
     Get the critical J values test
 
-    :param G:
-    :param T:
-    :param ts:
-    :return:
+    :param G: graph
+    :param T: iteration
+    :param ts: values of tau
+    :param replicas: number of replicas of each point
+    :param workers: number of worker processes
+    :return: return the critical J values
     """
-    results = {t_test: [], j_test: [], j_pred: []}
+    return risk_percolation_j_results(run_sweep(risk_percolation_j_jobs(g_type, T, ts, replicas),
+                                                {g_type: to_csr(G)}, workers=workers))
+
+
+def simulated_j_grid_test(G: nx.Graph,
+                          T: int,
+                          ts: np.array,
+                          js: np.array,
+                          size: int = batch_size,
+                          seed: int = master_seed,
+                          replicas: int = replicas) -> dict:
+    """
+    Get the critical J values test simulating the (tau, J) grid in batches of replicas
+    For each tau and replica the critical J is the first value of js for which the infection dies out,
+    and the replicas of a (tau, J) point are columns of the same batch. A tau is in the results once all its
+    replicas have a critical J. Each batch has the random stream of its (tau, J) values.
+
+    :param G: graph just infected
+    :param T: iteration
+    :param ts: values of tau
+    :param js: values of risk perception J
+    :param size: number of replicas simulated at the same time
+    :param seed: master seed
+    :param replicas: number of replicas of each point
+    :return: return the critical J values, with their statistics over the replicas if there are replicas
+    """
+    csr = to_csr(G)
+    infected_nodes = get_infected_mask(G)
     k = get_average_graph_degree(G)
+
+    # Scan the J values in blocks, each block is simulated for all the tau values still without a critical J
+    critical = {t: np.full(replicas, np.nan) for t in ts}
+    remaining = list(reversed(ts))
+    block = max(1, size // (len(ts) * replicas))
+    for start in range(0, len(js), block):
+        tt, jj = np.meshgrid(remaining, js[start:start + block], indexing="ij")
+        rng = stream((simulated_j_grid_test, tt.ravel(), jj.ravel(), replicas), seed)
+        taus, Js = np.repeat(tt.ravel(), replicas), np.repeat(jj.ravel(), replicas)
+        v = simulated_j_percolation_batch(csr, infected_nodes, taus, Js, T, rng).reshape(tt.shape + (replicas,))
+        for t, vt, jt in zip(remaining, v, jj):
+            for replica in np.flatnonzero(np.isnan(critical[t])):
+                below = np.flatnonzero(vt[:, replica] <= zero_threshold)
+                if below.size:
+                    critical[t][replica] = jt[below[0]]
+            if not np.isnan(critical[t]).any():
+                print(f"t: {round(t, 2)}, j: {round(critical[t].mean(), 2)}")
+        remaining = [t for t in remaining if np.isnan(critical[t]).any()]
+        if not remaining:
+            break
+
+    rows = []
     for t in reversed(ts):
-        jc_pred = critic_j_percolation(G, t, T)
-        j = get_critical_j(k, t)
-        results[t_test].append(t)
-        results[j_test].append(j)
-        results[j_pred].append(jc_pred)
-        print(f"t: {round(t, 2)}, j: {round(j, 2)}, jc: {round(jc_pred, 2)}")
-        print("--------------------------------------------------", end="\n\n")
-    return results
+        if not np.isnan(critical[t]).any():
+            row = {t_test: t, j_test: critical[t][0], j_pred: get_critical_j(k, t)}
+            if replicas > 1:
+                ensemble = Ensemble()
+                ensemble.add(critical[t])
+                row.update(ensemble.summary(j_test))
+            rows.append(row)
+    print("--------------------------------------------------", end="\n\n")
+    return merge_results(rows, [t_test, j_test, j_pred] + ensemble_keys(rows, [j_test]))
+
 
 # ______________________________________________________________________________________________________________________
 # The self-organized percolation method for multiplex networks
 
 
+def multiplex_percolation_jc_point(IG: CSRGraph,
+                                   PG: CSRGraph,
+                                   q: float,
+                                   T: int,
+                                   t: float,
+                                   rng: np.random.Generator = None) -> dict:
+    """
+    Get the critical J value of the multiplex percolation for one value of q and tau
+
+    :param IG: Information graph of q
+    :param PG: Physical graph
+    :param q: value of q
+    :param T: iteration
+    :param t: value of tau
+    :param rng: random generator
+    :return: return the results for q and tau
+    """
+    # Calculate the jc prediction about percolation
+    jc_pred = multiplex_percolation_csr(IG, PG, t, T, rng=rng)
+    print(f"q: {round(q, 2)}, t: {round(t, 2)} jc: {round(jc_pred, 2)}")
+    return {q_test: q, t_test: t, j_pred: jc_pred}
+
+
+def multiplex_percolation_jc_graphs(key, PG: CSRGraph, VG: CSRGraph, qs: np.array, seed: int = master_seed) -> dict:
+    """
+    Get the graphs of the multiplex percolation test, the physical graph and an information graph for each q
+
+    The information graphs of all the q values are built from the same random numbers, from the stream of the key.
+
+    :param key: key of the physical graph in the sweep, the information graphs have keys (key, index of q)
+    :param PG: Physical graph
+    :param VG: Virtual graph, with the same node index
+    :param qs: values of q
+    :param seed: master seed
+    :return: return the graphs of the test by key
+    """
+    draws = information_graph_draws(PG, VG, stream((multiplex_percolation_jc_graphs, key), seed))
+    graphs = {key: PG}
+    for i, q in enumerate(qs):
+        graphs[(key, i)] = get_information_graph_csr(PG, VG, q, draws)
+    return graphs
+
+
+def multiplex_percolation_jc_replica(physical: Callable,
+                                     virtual: Callable,
+                                     q: float,
+                                     rng: np.random.Generator) -> tuple:
+    """
+    Generate the graphs of a replica of the multiplex percolation test, a new physical, virtual and information graph
+
+    :param physical: generator of the physical graph, see generate_graph
+    :param virtual: generator of the virtual graph, with the same nodes
+    :param q: value of q
+    :param rng: random generator of the replica
+    :return: return the information graph and the physical graph
+    """
+    PG, VG = physical(rng=rng), virtual(rng=rng)
+    return get_information_graph_csr(PG, VG, q, information_graph_draws(PG, VG, rng)), PG
+
+
+def multiplex_percolation_jc_jobs(key,
+                                  T: int,
+                                  ts: np.array,
+                                  qs: np.array,
+                                  replicas: int = replicas,
+                                  graphs: tuple = None) -> list:
+    """
+    Get the jobs of the multiplex percolation test, one for each q and tau
+    With replicas the critical J is averaged over the replicas, see ensemble_jobs.
+
+    :param key: key of the physical graph in the sweep, see multiplex_percolation_jc_graphs
+    :param T: iteration
+    :param ts: values of tau
+    :param qs: values of q
+    :param replicas: number of replicas of each job
+    :param graphs: generators of a new physical and virtual graph for each replica, the graphs of the key if None
+    :return: return the jobs of the test
+    """
+    jobs = []
+    for i, q in enumerate(qs):
+        graph = None if graphs is None else partial(multiplex_percolation_jc_replica, *graphs, q)
+        jobs += ensemble_jobs([(multiplex_percolation_jc_point, ((key, i), key), (q, T, t)) for t in reversed(ts)],
+                              replicas, [j_pred], graph)
+    return jobs
+
+
+def multiplex_percolation_jc_results(rows: list) -> dict:
+    """
+    Merge the results of the jobs of the multiplex percolation test
+
+    :param rows: results of the jobs
+    :return: return the results of the test, with the statistics over the replicas if there are replicas
+    """
+    return merge_results(rows, [q_test, t_test, j_pred] + ensemble_keys(rows, [j_pred]))
+
+
 def multiplex_percolation_jc_test(PG: nx.Graph,
                                   VG: nx.Graph,
                                   T: int,
                                   ts: np.array,
-                                  qs: np.array) -> dict:
+                                  qs: np.array,
+                                  replicas: int = replicas,
+                                  workers: int = n_workers) -> dict:
     """
     Get the critical J values test
 
@@ -123,19 +426,10 @@ def multiplex_percolation_jc_test(PG: nx.Graph,
     :param T: iteration
     :param ts: values of tau
     :param qs: values of q
+    :param replicas: number of replicas of each point
+    :param workers: number of worker processes
     :return: return the results of the test
     """
-
-    results = {q_test: [], t_test: [], j_pred: []}
-    for q in qs:
-        IG = get_information_graph(PG, VG, q)
-        for t in reversed(ts):
-            print(f"q: {round(q, 2)}, t: {round(t, 2)}", end="")
-            # Calculate the jc prediction about percolation
-            jc_pred = multiplex_percolation(IG, PG, t, T)
-            print(f" jc: {round(jc_pred, 2)}")
-            results[q_test].append(q)
-            results[t_test].append(t)
-            results[j_pred].append(jc_pred)
-        print("--------------------------------------------------", end="\n\n")
-    return results
+    graphs = multiplex_percolation_jc_graphs(g_type, to_csr(PG), to_csr(VG, nodes=PG.nodes()), qs)
+    return multiplex_percolation_jc_results(run_sweep(multiplex_percolation_jc_jobs(g_type, T, ts, qs, replicas),
+                                                      graphs, workers=workers))
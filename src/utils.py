@@ -3,6 +3,12 @@ state = "state"
 infected = "infected"
 healthy = "healthy"
 recovered = "recovered"
+
+# Codes of the states in the uint8 arrays of node states
+healthy_code = 0
+infected_code = 1
+recovered_code = 2
+state_codes = {healthy: healthy_code, infected: infected_code, recovered: recovered_code}
 risk = "risk"
 j_value = "J"
 
@@ -11,18 +17,27 @@ t_test = "t_risk"
 j_test = "j_risk"
 t_pred = "t_pred"
 j_pred = "j_pred"
+j_low = "j_low"
+j_high = "j_high"
 q_test = "q_test"
 v_pred = "v_pred"
 g_type = "graph_type"
+err_suffix = "_err"  # Suffix of the standard error over the replicas of a result
 
 # Path plotting
 path_plots = "./results/plots/"
 path_results = "./results/csv/"
+path_graphs = "./results/cache/graphs/"
+path_journals = "./results/journals/"
+path_stores = "./results/stores/"
+path_memo = "./results/cache/memo/"
 
 # Test file path
 mean_field_jc_plot = "mfjcs"
 percolation_jc_plot = "percjcs"
 simple_tc_plot = "tcs"
+not_approx_jc_plot = "jcs"
+approx_plot_jc_plot = "approxjcs"
 
 critical_j_plot = "critical_j.png"
 